@@ -46,6 +46,12 @@ _debug_map = {
 _debug_prefix = {
     0x001: 'INFO: ',
 }
+# Numeric value of each debug level given to dprint(), a level name is
+# converted the first time it is used
+_debug_level_cache = {}
+# Display prefix of each numeric debug level, it is found the first time
+# a message is displayed for the level
+_debug_prefix_cache = {}
 
 def _init_debug():
     """Define all debug flags"""
@@ -55,6 +61,28 @@ def _init_debug():
         _debug_prefix[(2 << i)] = dbg.upper() + ': '
 _init_debug()
 
+def _get_level(level):
+    """Return the numeric value of the given debug level, either a number
+       or a name defined by debug_map().
+    """
+    ret = _debug_level_cache.get(level)
+    if ret is None:
+        ret = _debug_map[level.lower()] if type(level) == str else level
+        _debug_level_cache[level] = ret
+    return ret
+
+def _get_prefix(level):
+    """Return the display prefix of the given numeric debug level."""
+    prefix = _debug_prefix_cache.get(level)
+    if prefix is None:
+        prefix = ''
+        for bitmap in sorted(_debug_prefix):
+            if level & bitmap:
+                prefix = _debug_prefix[bitmap]
+                break
+        _debug_prefix_cache[level] = prefix
+    return prefix
+
 class BaseObj(object):
     """Base class so objects will inherit the methods which provide the string
        representation of the object and a simple debug printing and logging
@@ -191,6 +219,9 @@ class BaseObj(object):
             _debug_map[name] = bitmap
         if disp:
             _debug_prefix[bitmap] = disp
+        # Levels and prefixes are converted again using the new mapping
+        _debug_level_cache.clear()
+        _debug_prefix_cache.clear()
 
     @staticmethod
     def dindent(indent):
@@ -217,6 +248,35 @@ class BaseObj(object):
         if _logfh != None:
             _logfh.write(data + "\n")
 
+    @staticmethod
+    def debug_enabled(level):
+        """Return True if level is allowed by the verbose level given in
+           debug_level(), use it to avoid building an expensive debug
+           message which is not going to be displayed.
+
+           Examples:
+               if self.debug_enabled('PKT3'):
+                   self.dprint('PKT3', traceback.format_exc())
+        """
+        return bool(_get_level(level) & _dlevel)
+
+    def dprintf(self, level, fmt, *args):
+        """Print debug message if level is allowed by the verbose level
+           given in debug_level(). The message is given by the format string
+           and its arguments, the message is formatted only if it is going
+           to be displayed. Use it instead of dprint() in code executed for
+           every packet so nothing is formatted when debugging is disabled.
+
+           Examples:
+               # Same as self.dprint('PKT4', ">>> %d: next()" % self.index)
+               self.dprintf('PKT4', ">>> %d: next()", self.index)
+        """
+        nlevel = _debug_level_cache.get(level)
+        if nlevel is None:
+            nlevel = _get_level(level)
+        if nlevel & _dlevel:
+            self.dprint(nlevel, fmt % args if args else fmt)
+
     def dprint(self, level, msg, indent=0):
         """Print debug message if level is allowed by the verbose level
            given in debug_level().
@@ -224,17 +284,15 @@ class BaseObj(object):
         ret = ''
         if level is None:
             return
-        if type(level) == str:
-            level = _debug_map[level.lower()]
+        nlevel = _debug_level_cache.get(level)
+        if nlevel is None:
+            nlevel = _get_level(level)
+        level = nlevel
         if level & _dlevel:
             # Add display prefix only if msg is not an empty string
             if len(msg):
                 # Find the right display prefix
-                prefix = ' ' * _dindent
-                for bitmap in sorted(_debug_prefix):
-                    if level & bitmap:
-                        prefix += _debug_prefix[bitmap]
-                        break
+                prefix = ' ' * _dindent + _get_prefix(level)
                 # Add display prefix to the message
                 sp = ' ' * indent
                 ret = prefix + sp + msg
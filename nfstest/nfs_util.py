@@ -112,6 +112,7 @@ class NFSUtil(Host):
         self.clients = []
         self.clientobj = None
         self.traceproc = None
+        self.profiler = None  # Profiler given to every packet trace opened
         self.nii_name = ''    # nii_name for the client
         self.nii_server = ''  # nii_name for the server
         self.device_info = {}
@@ -238,18 +239,31 @@ class NFSUtil(Host):
         except:
             return
 
-    def trace_open(self, tracefile=None, **kwargs):
+    def trace_open(self, tracefile=None, tracedb=False, **kwargs):
         """Open the trace file given or the trace file started by trace_start().
 
+           tracefile:
+               Name of trace file to open [default: self.tracefile]
+           tracedb:
+               Use the trace database for NFS operation lookups, the database
+               is created next to the trace file if it does not exist or if
+               it is out of date [default: False]
+
            All extra options are passed directly to the packet trace object.
+           The profiler in the object attribute profiler, if any, is given
+           to the packet trace object unless the profiler option is given.
 
            Return the packet trace object created, the packet trace object
            is also stored in the object attribute pktt.
         """
         if tracefile is None:
             tracefile = self.tracefile
+        if self.profiler is not None:
+            kwargs.setdefault('profiler', self.profiler)
         self.dprint('DBG1', "trace_open [%s]" % tracefile)
         self.pktt = Pktt(tracefile, **kwargs)
+        if tracedb:
+            self.pktt.open_db()
         return self.pktt
 
     def nfs_debug_enable(self, **kwargs):
@@ -353,6 +367,26 @@ class NFSUtil(Host):
             dst += "TCP.dst_port == %d and " % port
         pktcall   = None
         pktreply  = None
+        if self.pktt.tracedb is not None:
+            # Decode only the calls and replies given by the trace database
+            save_index = self.pktt.index
+            rows = self.pktt.tracedb.find(op=op, src=src_ipaddr, dst=ipaddr, dport=port, start=save_index, end=maxindex)
+            for row in rows:
+                pktcall = self.pktt.match_index(src + dst + match + "NFS.argop == %d" % op, row['call_index'])
+                if pktcall is None:
+                    continue
+                # Search for the next call starting after this call
+                save_index = self.pktt.index
+                if call_only:
+                    return (pktcall, None)
+                reply_index = row['reply_index']
+                if reply_index is None or (maxindex and reply_index >= maxindex):
+                    continue
+                pktreply = self.pktt.match_index("RPC.xid == %d and %s NFS.resop == %d" % (row['xid'], mstatus, op), reply_index)
+                if pktreply:
+                    return (pktcall, pktreply)
+            self.pktt.rewind(save_index)
+            return (None, None)
         while True:
             # Find request
             pktcall = self.pktt.match(src + dst + match + "NFS.argop == %d" % op, maxindex=maxindex)
@@ -959,11 +993,7 @@ class NFSUtil(Host):
         io_op = OP_READ if iomode == LAYOUTIOMODE4_READ else OP_WRITE
 
         # Find all I/O requests for MDS or current DS
-        while True:
-            # Find I/O request
-            pkt = self.pktt.match(src + dst + fh + " and NFS.argop == %d" % io_op, maxindex=maxindex)
-            if not pkt:
-                break
+        for pkt in self.pktt.findall(src + dst + fh + " and NFS.argop == %d" % io_op, end=maxindex):
             xids.append(pkt.rpc.xid)
             nfsop = pkt.NFSop
             self.test_offsets.append(nfsop.offset)
@@ -1009,11 +1039,9 @@ class NFSUtil(Host):
             return 0
 
         # Find all I/O replies for MDS or current DS
-        while True:
-            # Find I/O reply
-            pkt = self.pktt.match("NFS.resop == %d" % io_op, maxindex=maxindex)
-            if not pkt:
-                break
+        reply_index = self.pktt.index
+        for pkt in self.pktt.findall("NFS.resop == %d" % io_op, end=maxindex):
+            reply_index = self.pktt.index
             xid = pkt.rpc.xid
             if xid in xids:
                 xids.remove(xid)
@@ -1057,6 +1085,9 @@ class NFSUtil(Host):
             else:
                 # Call was not found for this reply
                 self.test_niomiss += 1
+        if self.pktt.index != reply_index:
+            # Re-position trace file right after the last I/O reply
+            self.pktt.rewind(reply_index)
         # Add the number of calls with no replies
         self.test_niomiss += len(xids)
         nops = good_pattern + bad_pattern + self.test_niomiss
@@ -1090,41 +1121,34 @@ class NFSUtil(Host):
         """
         dst = self.pktt.ip_tcp_dst_expr(ipaddr, port)
         fh = "NFS.object == '%s'" % self.pktt.escape(filehandle)
-        save_index = self.pktt.index
-        xids = []
         if init:
             self.test_commit_full = True
             self.test_no_commit   = False
             self.test_commit_verf = True
 
-        while True:
-            # Find COMMIT request for current DS
-            pkt = self.pktt.match(dst + " and " + fh + " and NFS.argop == %d" % OP_COMMIT)
-            if not pkt:
-                break
-            xids.append(pkt.rpc.xid)
+        # Find all COMMIT requests for current DS and their replies
+        # in a single pass
+        calls = []
+        for pkt, pktreply in self.pktt.pairs(dst + " and " + fh + " and NFS.argop == %d" % OP_COMMIT):
+            calls.append(pkt)
+            for item in getattr(pktreply.nfs, 'resarray', []):
+                if item.resop == OP_COMMIT:
+                    if self.writeverf != getattr(item, 'writeverf', None):
+                        self.test_commit_verf = False
+                    break
+        # Include every COMMIT request sent, the retransmitted requests
+        # and the requests without a reply
+        calls += self.pktt.retransmitted + self.pktt.unmatched
+
+        for pkt in calls:
             nfscommit = pkt.NFSop
             if nfscommit.offset != 0 or nfscommit.count != 0:
                 self.test_commit_full = False
 
-        ncommits = len(xids)
+        ncommits = len(calls)
         if ncommits == 0:
             # No COMMIT was found
             self.test_no_commit = True
-            return 0
-
-        # Rewind trace file to saved packet index
-        self.pktt.rewind(save_index)
-        while True:
-            # Find COMMIT reply for current DS
-            pkt = self.pktt.match("NFS.resop == %d" % OP_COMMIT)
-            if not pkt:
-                break
-            if pkt.rpc.xid in xids:
-                nfscommit = pkt.NFSop
-                if self.writeverf != nfscommit.writeverf:
-                    self.test_commit_verf = False
-
         return ncommits
 
     def verify_layoutcommit(self, filehandle, filesize):
@@ -54,6 +54,7 @@ from host import Host
 import nfstest_config as c
 from baseobj import BaseObj
 from nfs_util import NFSUtil
+from packet.profiler import MatchProfiler
 from optparse import OptionParser, IndentedHelpFormatter
 
 # Module constants
@@ -218,8 +219,24 @@ class TestUtil(NFSUtil):
         total_str = "\nTotal time: %s" % self._print_time(self.total_time)
         self.write_log(total_str)
         print total_str
+        self._pktprof()
         self.close_log()
 
+    def _pktprof(self):
+        """Process --pktprof option."""
+        if self.profiler is None or not self.profiler.calls:
+            return
+        if self.pktprof == 'report':
+            msg = "\nPacket trace profile:\n" + self.profiler.report()
+        else:
+            try:
+                self.profiler.dump(self.pktprof)
+                msg = "\nPacket trace profile: %s" % self.pktprof
+            except Exception as e:
+                msg = "\nUnable to save packet trace profile to '%s': %r" % (self.pktprof, e)
+        self.write_log(msg)
+        print msg
+
     def _verify_testnames(self):
         """Process --runtest option."""
         if not hasattr(self, 'runtest'):
@@ -293,6 +310,7 @@ class TestUtil(NFSUtil):
         self.opts.add_option("--iptables", default=self.iptables, help="Full path of binary for iptables [default: '%default']")
         self.opts.add_option("--messages", default=self.messages, help="Full path of log messages file [default: '%default']")
         self.opts.add_option("--tmpdir", default=self.tmpdir, help="Temporary directory [default: '%default']")
+        self.opts.add_option("--pktprof", default='', help="Profile all match() and rewind() calls on the packet trace, display the report at exit if set to 'report', otherwise save the profile as JSON in the given file [default: no profiling]")
         usage = self.usage
         if len(self.testnames) > 0:
             self.opts.add_option("--runtest", default='all', help="Comma separated list of tests to run [default: '%default']")
@@ -532,6 +550,8 @@ class TestUtil(NFSUtil):
             self.ipaddr = self.client_ipaddr
             if self.nfsversion < 4:
                 self.minorversion = 0
+            if self.pktprof:
+                self.profiler = MatchProfiler()
 
             self.tverbose = _tverbose_map.get(self.tverbose)
             if self.tverbose is None:
@@ -114,9 +114,17 @@ NFSTEST_ALLMODS = [
     'nfstest/host.py',
     'nfstest/nfs_util.py',
     'nfstest/test_util.py',
+    'packet/frame.py',
+    'packet/multipktt.py',
     'packet/pkt.py',
     'packet/pktt.py',
+    'packet/prefetch.py',
+    'packet/profiler.py',
     'packet/record.py',
+    'packet/sample.py',
+    'packet/summary.py',
+    'packet/tracedb.py',
+    'packet/traceset.py',
     'packet/unpack.py',
     'packet/application/rpc.py',
     'packet/application/rpc_const.py',
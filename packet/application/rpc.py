@@ -17,12 +17,13 @@ RPC module
 Decode RPC layer.
 """
 import struct
+import weakref
 import traceback
 from gss import GSS
 from rpc_const import *
 import nfstest_config as c
 from baseobj import BaseObj
-from packet.nfs.nfs4lib import FancyNFS4Unpacker
+from packet.nfs.nfs4lib import FancyNFS4Unpacker, TimedNFS4Unpacker
 
 # Module constants
 __author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
@@ -124,15 +125,21 @@ class RPC(GSS):
            proto:
                Transport layer protocol.
         """
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
         self.data = data
         self._rpc = False
-        self._pktt = pktt
+        # Do not keep the packet trace object alive from its own packets
+        self._pktt = weakref.proxy(pktt)
         self._proto = proto
 
         try:
             self._rpc_header()
         except:
             pass
+        if timing is not None:
+            timing.stop('RPC', token)
 
     def _rpc_header(self):
         """Internal method to decode RPC header"""
@@ -218,7 +225,7 @@ class RPC(GSS):
         self._rpc = True
         xid = self.xid
         pktt = self._pktt
-        if not getattr(pktt, '_rpc_xid_map', None):
+        if getattr(pktt, '_rpc_xid_map', None) is None:
             # NFS XID map: to keep track of call information
             # (program, version, procedure, ...) and insert
             # this information into the proper NFS reply
@@ -345,7 +352,14 @@ class RPC(GSS):
            SEQUENCE4res, GETATTR4res, etc.
         """
         ret = None
-        self.decode_gss_data()
+        timing = self._pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            self.decode_gss_data()
+        finally:
+            if timing is not None:
+                timing.stop('GSS', token)
 
         try:
             # Set variables for ease of use
@@ -375,33 +389,52 @@ class RPC(GSS):
             if procedure == 1 and ((not cb_flag and version == 4) or
                                    (cb_flag and version == 1)):
                 # Create object to unpack the NFS layer
-                unpacker = FancyNFS4Unpacker(self.data)
-                unpacker.check_enum = False
-                if self.type == CALL:
-                    # RPC call
-                    if cb_flag:
-                        # This packet is definitely not program 100003
-                        # so treat it like a NFS callback
-                        ret = unpacker.unpack_CB_COMPOUND4args()
-                    else:
-                        # This packet NFS
-                        ret = unpacker.unpack_COMPOUND4args()
+                if timing is not None:
+                    token = timing.start()
+                    unpacker = TimedNFS4Unpacker(self.data, timing)
                 else:
-                    # RPC reply
-                    if cb_flag:
-                        # This packet is definitely not program 100003
-                        # so treat it like a NFS callback
-                        ret = unpacker.unpack_CB_COMPOUND4res()
+                    unpacker = FancyNFS4Unpacker(self.data)
+                try:
+                    unpacker.check_enum = False
+                    if self.type == CALL:
+                        # RPC call
+                        if cb_flag:
+                            # This packet is definitely not program 100003
+                            # so treat it like a NFS callback
+                            ret = unpacker.unpack_CB_COMPOUND4args()
+                        else:
+                            # This packet NFS
+                            ret = unpacker.unpack_COMPOUND4args()
                     else:
-                        # This packet NFS
-                        ret = unpacker.unpack_COMPOUND4res()
-
-                # Position data pointer to include bytes processed by NFS
-                self.data = self.data[unpacker.get_position():]
-                self.decode_gss_checksum()
+                        # RPC reply
+                        if cb_flag:
+                            # This packet is definitely not program 100003
+                            # so treat it like a NFS callback
+                            ret = unpacker.unpack_CB_COMPOUND4res()
+                        else:
+                            # This packet NFS
+                            ret = unpacker.unpack_COMPOUND4res()
+
+                    # Position data pointer to include bytes processed by NFS
+                    self.data = self.data[unpacker.get_position():]
+                    if self._pktt._isnew:
+                        self._pktt.counters['nfs_bytes'] += unpacker.get_position()
+                finally:
+                    if timing is not None:
+                        timing.stop('NFS', token)
+                if timing is not None:
+                    token = timing.start()
+                try:
+                    self.decode_gss_checksum()
+                finally:
+                    if timing is not None:
+                        timing.stop('GSS', token)
         except Exception:
             # Could not decode NFS packet
-            self.dprint('PKT3', traceback.format_exc())
+            if self.debug_enabled('PKT3'):
+                self.dprint('PKT3', traceback.format_exc())
+            if self._pktt._isnew:
+                self._pktt.counters['nfs_errors'] += 1
             return
         return ret
 
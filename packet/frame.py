@@ -0,0 +1,405 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Packet frame module
+
+Provides the columnar representation of a packet trace file. The frame is
+a NumPy structured array with one row for each packet in the trace file,
+where the row number is the packet index, and one column for each of the
+requested fields. Building the frame takes a single pass over the trace
+file, afterwards any analysis like counting operations, computing latencies
+or I/O size histograms can be done using NumPy vectorized operations instead
+of decoding the whole trace file every time.
+
+The frame is also used as a match backend: a match expression comparing
+the IP addresses, TCP ports, RPC xid and type or the NFS operations against
+constant values is converted into a NumPy boolean mask so only the packets
+given by the mask need to be decoded, see frame_match().
+
+NumPy is an optional dependency, it is only required when a frame is built.
+
+Frame fields:
+    index    = Packet index
+    ts       = Packet timestamp in seconds relative to the first packet
+    length   = Number of bytes on the wire
+    src      = Source IP address
+    dst      = Destination IP address
+    sport    = TCP source port
+    dport    = TCP destination port
+    xid      = RPC transaction id
+    type     = RPC message type: 0 for CALL, 1 for REPLY, -1 if not RPC
+    call     = Packet index of the call for an RPC reply, -1 otherwise
+    op       = Main NFS operation in the compound, -1 if not NFS
+    opcodes  = All NFS operations in the compound, padded with -1
+    status   = NFS compound status for a reply, -1 otherwise
+    offset   = File offset of the main I/O operation
+    count    = Number of bytes of the main I/O operation
+    stateid  = Hash of the stateid 'other' field, 0 if no stateid
+    fh       = Hash of the file handle given by PUTFH, 0 if no PUTFH
+
+Examples:
+    from packet.pktt import Pktt
+
+    x = Pktt("/traces/tracefile.cap")
+    frame = x.to_frame()
+
+    # Number of WRITE calls
+    writes = frame[(frame['type'] == 0) & (frame['op'] == 38)]
+    print len(writes)
+
+    # Latency of all replies
+    replies = frame[frame['call'] >= 0]
+    latency = replies['ts'] - frame['ts'][replies['call']]
+"""
+import ast
+import operator
+import nfstest_config as c
+from packet.nfs.nfs4_const import *
+from packet.summary import match_literal
+from packet.internet.ipv6addr import IPv6Addr
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Maximum number of operations in the compound saved in the opcodes field
+FRAME_MAXOPS = 16
+
+# Definition of all frame fields: (name, dtype, default value)
+FRAME_FIELDS = [
+    ('index',   'u4',  0),
+    ('ts',      'f8',  0.0),
+    ('length',  'u4',  0),
+    ('src',     'S39', ''),
+    ('dst',     'S39', ''),
+    ('sport',   'u2',  0),
+    ('dport',   'u2',  0),
+    ('xid',     'u4',  0),
+    ('type',    'i1',  -1),
+    ('call',    'i4',  -1),
+    ('op',      'i2',  -1),
+    ('opcodes', ('i2', (FRAME_MAXOPS,)), (-1,)*FRAME_MAXOPS),
+    ('status',  'i4',  -1),
+    ('offset',  'u8',  0),
+    ('count',   'u4',  0),
+    ('stateid', 'i8',  0),
+    ('fh',      'i8',  0),
+]
+FRAME_FIELD_NAMES = [item[0] for item in FRAME_FIELDS]
+_FRAME_field_map = dict((item[0], idx) for idx, item in enumerate(FRAME_FIELDS))
+
+# Operations skipped when looking for the main operation in the compound
+_FRAME_nomainop = set([OP_SEQUENCE, OP_PUTFH, OP_PUTPUBFH, OP_PUTROOTFH])
+
+def _frame_row(pkt):
+    """Return a list of the values of all frame fields for the given packet"""
+    row = [item[2] for item in FRAME_FIELDS]
+    record = pkt.record
+    row[0] = record.index
+    row[1] = record.secs
+    row[2] = record.length_orig
+
+    ip = getattr(pkt, 'ip', None)
+    if ip is not None:
+        row[3] = ip.src
+        row[4] = ip.dst
+    tcp = getattr(pkt, 'tcp', None)
+    if tcp is not None:
+        row[5] = tcp.src_port
+        row[6] = tcp.dst_port
+    rpc = getattr(pkt, 'rpc', None)
+    if rpc is not None:
+        row[7] = rpc.xid
+        row[8] = rpc.type
+        row[9] = getattr(rpc, 'call_index', -1)
+
+    nfs = getattr(pkt, 'nfs', None)
+    if nfs is None:
+        return row
+    array = getattr(nfs, 'argarray', None)
+    if array is None:
+        array = getattr(nfs, 'resarray', None)
+        if array is None:
+            return row
+        opname = 'resop'
+        row[12] = nfs.status
+    else:
+        opname = 'argop'
+
+    mainop = None
+    opcodes = []
+    for item in array:
+        op = getattr(item, opname)
+        opcodes.append(op)
+        if op == OP_PUTFH:
+            row[16] = hash(getattr(item, 'object', ''))
+        elif mainop is None and op not in _FRAME_nomainop:
+            mainop = item
+            row[10] = op
+    opcodes = opcodes[:FRAME_MAXOPS]
+    row[11] = tuple(opcodes) + (-1,)*(FRAME_MAXOPS - len(opcodes))
+
+    if mainop is not None:
+        # Get the I/O information from the main operation
+        offset = getattr(mainop, 'offset', None)
+        if offset is not None:
+            row[13] = offset
+        count = getattr(mainop, 'count', None)
+        if count is None:
+            data = getattr(mainop, 'data', None)
+            if data is not None:
+                count = len(data)
+        if count is not None:
+            row[14] = count
+        stateid = getattr(mainop, 'stateid', None)
+        if stateid is not None:
+            row[15] = hash(stateid.other)
+    return row
+
+def frame_dtype(fields=None):
+    """Return the NumPy dtype definition for the given list of fields
+
+       fields:
+           List of field names, all fields are used if this is None
+    """
+    if fields is None:
+        return [item[:2] for item in FRAME_FIELDS]
+    dtype = []
+    for name in fields:
+        idx = _FRAME_field_map.get(name)
+        if idx is None:
+            raise Exception("Unknown frame field: %s" % name)
+        dtype.append(FRAME_FIELDS[idx][:2])
+    return dtype
+
+def pkt_frame(pkts, fields=None):
+    """Return a NumPy structured array for all packets in the given
+       iterable, the array has a column for each of the given fields.
+
+       pkts:
+           Iterable of packet objects (packet.pkt.Pkt)
+       fields:
+           List of field names, all fields are used if this is None
+    """
+    if numpy is None:
+        raise Exception("NumPy is required to build the packet frame")
+    dtype = frame_dtype(fields)
+    if fields is None:
+        rows = [tuple(_frame_row(pkt)) for pkt in pkts]
+    else:
+        idxlist = [_FRAME_field_map[name] for name in fields]
+        rows = []
+        for pkt in pkts:
+            row = _frame_row(pkt)
+            rows.append(tuple([row[idx] for idx in idxlist]))
+    return numpy.array(rows, dtype=dtype)
+
+# Map of match expression attributes to frame fields:
+# (layer, attribute) -> (field, RPC message type or None)
+_FRAME_match_map = {
+    ('IP',  'src'):      ('src',     None),
+    ('IP',  'dst'):      ('dst',     None),
+    ('TCP', 'src_port'): ('sport',   None),
+    ('TCP', 'dst_port'): ('dport',   None),
+    ('RPC', 'xid'):      ('xid',     None),
+    ('RPC', 'type'):     ('type',    None),
+    ('NFS', 'op'):       ('opcodes', None),
+    ('NFS', 'argop'):    ('opcodes', 0),
+    ('NFS', 'resop'):    ('opcodes', 1),
+}
+
+# Map of comparison operators
+_FRAME_cmp_map = {
+    ast.Eq:    operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt:    operator.lt,
+    ast.LtE:   operator.le,
+    ast.Gt:    operator.gt,
+    ast.GtE:   operator.ge,
+}
+
+def _frame_ipaddrs(value):
+    """Return the list of strings an IP address literal could match in the
+       src and dst fields. An IPv4 address is saved as given by the packet
+       while an IPv6 address is saved in its compressed form, so the literal
+       is also converted the same way IPv6Addr does when comparing addresses.
+    """
+    ret = []
+    if isinstance(value, str):
+        ret.append(value)
+    elif not isinstance(value, (int, long)):
+        raise ValueError("Invalid IP address: %r" % (value,))
+    try:
+        ipaddr = IPv6Addr._convert(value)
+        if ipaddr not in ret:
+            ret.append(ipaddr)
+    except Exception:
+        # Not a valid IPv6 address
+        pass
+    return ret
+
+def _frame_compare(frame, node):
+    """Return the boolean mask for a single comparison or None if the
+       comparison cannot be expressed using the frame fields.
+    """
+    if len(node.ops) != 1:
+        return None
+    lhs = node.left
+    if not isinstance(lhs, ast.Attribute) or not isinstance(lhs.value, ast.Name):
+        return None
+    item = _FRAME_match_map.get((lhs.value.id, lhs.attr))
+    if item is None or item[0] not in frame.dtype.names:
+        return None
+    field, mtype = item
+    if mtype is not None and 'type' not in frame.dtype.names:
+        return None
+    try:
+        value = match_literal(node.comparators[0])
+    except Exception:
+        return None
+
+    column = frame[field]
+    opr = type(node.ops[0])
+    try:
+        if field in ('src', 'dst') and opr in (ast.Eq, ast.NotEq, ast.In):
+            # Compare IP addresses the same way IPv6Addr does
+            if opr is ast.In:
+                if not isinstance(value, (list, tuple, set)):
+                    return None
+                value = list(value)
+            else:
+                value = [value]
+            addrs = []
+            for item in value:
+                addrs.extend(_frame_ipaddrs(item))
+            mask = numpy.in1d(column, addrs).reshape(column.shape)
+            if opr is ast.NotEq:
+                mask = ~mask
+        elif opr is ast.In:
+            if not isinstance(value, (list, tuple, set)):
+                return None
+            mask = numpy.in1d(column, list(value)).reshape(column.shape)
+        elif opr in _FRAME_cmp_map:
+            if isinstance(value, (list, tuple, set, dict)):
+                return None
+            mask = _FRAME_cmp_map[opr](column, value)
+        else:
+            return None
+    except Exception:
+        return None
+    if not isinstance(mask, numpy.ndarray) or mask.shape != column.shape:
+        return None
+
+    if field == 'opcodes':
+        # Match any of the operations in the compound, the compound could
+        # have more operations than the ones saved so include those
+        # packets as well
+        mask = (mask & (column != -1)).any(axis=1) | (column[:,-1] != -1)
+        if mtype is not None:
+            mask &= (frame['type'] == mtype)
+    return mask
+
+def _frame_mask(frame, node):
+    """Return the boolean mask for the given expression node or None if the
+       expression cannot be expressed using the frame fields.
+
+       The mask is a superset of the packets matching the expression, that
+       is, a term which cannot be expressed using the frame fields is ignored
+       when it is part of an 'and' expression.
+    """
+    if isinstance(node, ast.Compare):
+        return _frame_compare(frame, node)
+    elif isinstance(node, ast.BoolOp):
+        masks = [_frame_mask(frame, item) for item in node.values]
+        if isinstance(node.op, ast.And):
+            masks = [mask for mask in masks if mask is not None]
+            if len(masks) == 0:
+                return None
+            return reduce(operator.and_, masks)
+        elif [mask for mask in masks if mask is None]:
+            return None
+        return reduce(operator.or_, masks)
+    return None
+
+def frame_match(frame, expr, start=0, maxindex=None):
+    """Return the list of candidate packet indexes for the given match
+       expression or None if the expression cannot be expressed using the
+       frame fields. All packets matching the expression are in the list,
+       but not every packet in the list is guaranteed to match so each
+       candidate must be verified by the caller.
+
+       frame:
+           Packet frame as returned by pkt_frame()
+       expr:
+           Match expression, see packet.pktt.Pktt.match()
+       start:
+           Return only packet indexes starting at this index
+       maxindex:
+           Return only packet indexes less than this index
+    """
+    if numpy is None or frame is None:
+        return None
+    try:
+        node = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    mask = _frame_mask(frame, node)
+    if mask is None:
+        return None
+    if maxindex:
+        mask = mask[:maxindex]
+    idxlist = numpy.nonzero(mask[start:])[0] + start
+    return idxlist.tolist()
+
+if __name__ == '__main__':
+    # Self test of module
+    if numpy is None:
+        print "NumPy is not installed, no tests were run"
+        exit(0)
+    rows = []
+    addrs = ['fe80::20c:29ff:fe54:9ef', '192.168.0.17', 'fe80::1']
+    for idx, addr in enumerate(addrs):
+        row = [item[2] for item in FRAME_FIELDS]
+        row[0] = idx
+        row[3] = addr
+        row[11] = (OP_WRITE,) + (-1,)*(FRAME_MAXOPS - 1)
+        rows.append(tuple(row))
+    frame = numpy.array(rows, dtype=frame_dtype())
+    exprs = [
+        ("IP.src == 'fe80:0000:0000:0000:020c:29ff:fe54:09ef'", [0]),
+        ("IP.src == 'FE80::20C:29FF:FE54:9EF' and NFS.op == 38", [0]),
+        ("IP.src == 0xfe80000000000000020c29fffe5409ef", [0]),
+        ("IP.src == '192.168.0.17'", [1]),
+        ("IP.src != 'FE80::20C:29FF:FE54:9EF'", [1, 2]),
+        ("IP.src in ['FE80:0:0:0:0:0:0:1', '192.168.0.17']", [1, 2]),
+    ]
+    ntests = len(exprs)
+    tcount = 0
+    for expr, idxlist in exprs:
+        if frame_match(frame, expr) == idxlist:
+            tcount += 1
+
+    if tcount == ntests:
+        print "All tests passed!"
+        exit(0)
+    else:
+        print "%d tests failed" % (ntests-tcount)
+        exit(1)
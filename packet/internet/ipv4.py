@@ -16,7 +16,6 @@ IPv4 module
 
 Decode IP version 4 layer.
 """
-import struct
 import nfstest_config as c
 from baseobj import BaseObj
 from packet.transport.tcp import TCP
@@ -31,6 +30,19 @@ __license__   = "GPL v2"
 # Name of different protocols
 _IP_map = {1:'ICMP', 2:'IGMP', 6:'TCP', 17:'UDP' }
 
+# Address map: dotted-quad string representation of every IP address
+# seen so far keyed by its raw 32 bit integer value, so each address is
+# only formatted the first time it is found in the trace file
+_IPv4_addr_map = {}
+
+def _ipv4_addr(addr):
+    """Return the dotted-quad string for the given 32 bit integer address"""
+    ret = _IPv4_addr_map.get(addr)
+    if ret is None:
+        ret = "%d.%d.%d.%d" % (addr >> 24, (addr >> 16) & 0xFF, (addr >> 8) & 0xFF, addr & 0xFF)
+        _IPv4_addr_map[addr] = ret
+    return ret
+
 class TOS(BaseObj): pass
 class Flags(BaseObj): pass
 
@@ -85,48 +97,60 @@ class IPv4(BaseObj, Unpack):
            data:
                Raw packet data for this layer.
         """
-        self.data = data
-        # Get the IP version and header length
-        temp = self.unpack(1, 'B')[0]
-        count = 4*(temp & 0x0F)
-
-        # Decode IP header
-        ulist = self.unpack(19, 'BHHHBBH4s4s')
-        self.version         = (temp >> 4)
-        self.IHL             = (temp & 0x0F)
-        self.header_size     = count
-        self.total_size      = ulist[1]
-        self.id              = ulist[2]
-        self.fragment_offset = (ulist[3] & 0x1FFF)
-        self.TTL             = ulist[4]
-        self.protocol        = ulist[5]
-        self.checksum        = ulist[6]
-        self.src             = "%d.%d.%d.%d" % struct.unpack('!4B', ulist[7])
-        self.dst             = "%d.%d.%d.%d" % struct.unpack('!4B', ulist[8])
-        self.TOS = TOS(
-            precedence    = (ulist[0] >> 5),
-            delay         = ((ulist[0] >> 4) & 0x01),
-            throughput    = ((ulist[0] >> 3) & 0x01),
-            reliability   = ((ulist[0] >> 2) & 0x01),
-            monetary_cost = ((ulist[0] >> 1) & 0x01),
-        )
-        self.DSCP = (ulist[0] >> 2)
-        self.ECN  = (ulist[0] & 0x03)
-        self.flags = Flags(
-            DF = ((ulist[3] >> 14) & 0x01),
-            MF = ((ulist[3] >> 13) & 0x01),
-        )
-        pktt.pkt.ip = self
-
-        if count > 20:
-            # Save IP options
-            osize = count - 20
-            self.options = self.rawdata(osize)
-
-        if self.protocol == 6:
-            # Decode TCP
-            TCP(pktt, self.data)
-            del self.data
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            self.data = data
+            if pktt._isnew:
+                pktt.counters['ip_bytes'] += len(data)
+            # Get the IP version and header length
+            temp = self.unpack(1, 'B')[0]
+            count = 4*(temp & 0x0F)
+
+            # Decode IP header
+            ulist = self.unpack(19, 'BHHHBBHII')
+            self.version         = (temp >> 4)
+            self.IHL             = (temp & 0x0F)
+            self.header_size     = count
+            self.total_size      = ulist[1]
+            self.id              = ulist[2]
+            self.fragment_offset = (ulist[3] & 0x1FFF)
+            self.TTL             = ulist[4]
+            self.protocol        = ulist[5]
+            self.checksum        = ulist[6]
+            self.src             = _ipv4_addr(ulist[7])
+            self.dst             = _ipv4_addr(ulist[8])
+            # Raw addresses used as the key to identify the TCP stream
+            self._saddr          = ulist[7]
+            self._daddr          = ulist[8]
+            self.TOS = TOS(
+                precedence    = (ulist[0] >> 5),
+                delay         = ((ulist[0] >> 4) & 0x01),
+                throughput    = ((ulist[0] >> 3) & 0x01),
+                reliability   = ((ulist[0] >> 2) & 0x01),
+                monetary_cost = ((ulist[0] >> 1) & 0x01),
+            )
+            self.DSCP = (ulist[0] >> 2)
+            self.ECN  = (ulist[0] & 0x03)
+            self.flags = Flags(
+                DF = ((ulist[3] >> 14) & 0x01),
+                MF = ((ulist[3] >> 13) & 0x01),
+            )
+            pktt.pkt.ip = self
+
+            if count > 20:
+                # Save IP options
+                osize = count - 20
+                self.options = self.rawdata(osize)
+
+            if self.protocol == 6:
+                # Decode TCP
+                TCP(pktt, self.data)
+                del self.data
+        finally:
+            if timing is not None:
+                timing.stop('IPv4', token)
         return
 
     def __str__(self):
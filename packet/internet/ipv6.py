@@ -62,21 +62,32 @@ class IPv6(IPv4):
            data:
                Raw packet data for this layer.
         """
-        self.data = data
-        ulist = self.unpack(8, 'IHBB')
-        self.version       = (ulist[0] >> 28)
-        self.traffic_class = (ulist[0] >> 20)&0xFF
-        self.flow_label    = ulist[0]&0xFFF
-        self.total_size    = ulist[1]
-        self.protocol      = ulist[2]
-        self.hop_limit     = ulist[3]
-        self.src           = IPv6Addr(self.rawdata(16).encode('hex'))
-        self.dst           = IPv6Addr(self.rawdata(16).encode('hex'))
-        pktt.pkt.ip = self
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            self.data = data
+            if pktt._isnew:
+                pktt.counters['ip_bytes'] += len(data)
+            ulist = self.unpack(8, 'IHBB')
+            self.version       = (ulist[0] >> 28)
+            self.traffic_class = (ulist[0] >> 20)&0xFF
+            self.flow_label    = ulist[0]&0xFFF
+            self.total_size    = ulist[1]
+            self.protocol      = ulist[2]
+            self.hop_limit     = ulist[3]
+            self._saddr        = self.rawdata(16)
+            self._daddr        = self.rawdata(16)
+            self.src           = IPv6Addr.fromraw(self._saddr)
+            self.dst           = IPv6Addr.fromraw(self._daddr)
+            pktt.pkt.ip = self
 
-        if self.protocol == 6:
-            # Decode TCP
-            TCP(pktt, self.data)
-            del self.data
+            if self.protocol == 6:
+                # Decode TCP
+                TCP(pktt, self.data)
+                del self.data
+        finally:
+            if timing is not None:
+                timing.stop('IPv6', token)
         return
 
@@ -27,6 +27,9 @@ __version__   = '1.0.1'
 __copyright__ = "Copyright (C) 2012 NetApp, Inc."
 __license__   = "GPL v2"
 
+# IPv6 address objects already created keyed by their raw 16 byte address
+_IPv6Addr_map = {}
+
 class IPv6Addr(str):
     """IPv6Addr address object
 
@@ -98,6 +101,18 @@ class IPv6Addr(str):
         """
         return super(IPv6Addr, cls).__new__(cls, IPv6Addr._convert(ip))
 
+    @staticmethod
+    def fromraw(data):
+        """Return the IPv6Addr object for the given raw 16 byte address.
+           The object is created only the first time the address is given,
+           afterwards the same object is returned.
+        """
+        ret = _IPv6Addr_map.get(data)
+        if ret is None:
+            ret = IPv6Addr(data.encode('hex'))
+            _IPv6Addr_map[data] = ret
+        return ret
+
     def __eq__(self, other):
         """Compare two IPv6 addresses and return True if both are equal."""
         return str(self) == self._convert(other)
@@ -112,7 +127,7 @@ if __name__ == '__main__':
     ip = IPv6Addr('fe80000000000000020c29fffe5409ef')
     ipstr = "%s" % ip
     iprpr = "%r" % ip
-    ntests = 16
+    ntests = 17
 
     tcount = 0
     if ip == 0xFE80000000000000020C29FFFE5409EF:
@@ -153,6 +168,11 @@ if __name__ == '__main__':
     except ValueError:
         tcount += 1
 
+    rawip = '\xfe\x80' + '\x00'*6 + '\x02\x0c\x29\xff\xfe\x54\x09\xef'
+    ip = IPv6Addr.fromraw(rawip)
+    if ip == 'fe80::20c:29ff:fe54:9ef' and ip is IPv6Addr.fromraw(rawip):
+        tcount += 1
+
     if tcount == ntests:
         print "All tests passed!"
         exit(0)
@@ -62,21 +62,30 @@ class ETHERNET(BaseObj, Unpack):
            data:
                Raw packet data for this layer.
         """
-        self.data = data
-        self.dst  = MacAddr(self.rawdata(6).encode('hex'))
-        self.src  = MacAddr(self.rawdata(6).encode('hex'))
-        self.type = self.unpack(2, 'H')[0]
-        pktt.pkt.ethernet = self
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            self.data = data
+            if pktt._isnew:
+                pktt.counters['ethernet_bytes'] += len(data)
+            self.dst  = MacAddr.fromraw(self.rawdata(6))
+            self.src  = MacAddr.fromraw(self.rawdata(6))
+            self.type = self.unpack(2, 'H')[0]
+            pktt.pkt.ethernet = self
 
-        payload = None
-        if self.type == 0x0800:
-            # Decode IPv4 packet
-            payload = IPv4(pktt, self.data)
-        elif self.type == 0x86dd:
-            # Decode IPv6 packet
-            payload = IPv6(pktt, self.data)
-        if payload:
-            del self.data
+            payload = None
+            if self.type == 0x0800:
+                # Decode IPv4 packet
+                payload = IPv4(pktt, self.data)
+            elif self.type == 0x86dd:
+                # Decode IPv6 packet
+                payload = IPv6(pktt, self.data)
+            if payload:
+                del self.data
+        finally:
+            if timing is not None:
+                timing.stop('ETHERNET', token)
         return
 
     def __str__(self):
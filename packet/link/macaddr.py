@@ -26,6 +26,9 @@ __version__   = '1.0.1'
 __copyright__ = "Copyright (C) 2012 NetApp, Inc."
 __license__   = "GPL v2"
 
+# MAC address objects already created keyed by their raw 6 byte address
+_MacAddr_map = {}
+
 class MacAddr(str):
     """MacAddr address object
 
@@ -56,6 +59,18 @@ class MacAddr(str):
         """
         return super(MacAddr, cls).__new__(cls, MacAddr._convert(mac))
 
+    @staticmethod
+    def fromraw(data):
+        """Return the MacAddr object for the given raw 6 byte address.
+           The object is created only the first time the address is given,
+           afterwards the same object is returned.
+        """
+        ret = _MacAddr_map.get(data)
+        if ret is None:
+            ret = MacAddr(data.encode('hex'))
+            _MacAddr_map[data] = ret
+        return ret
+
     def __eq__(self, other):
         """Compare two MAC addresses and return True if both are equal."""
         return str(self) == self._convert(other)
@@ -69,7 +84,7 @@ if __name__ == '__main__':
     mac = MacAddr('E4CE8F589FF4')
     macstr = "%s" % mac
     macrpr = "%r" % mac
-    ntests = 6
+    ntests = 7
 
     tcount = 0
     if mac == 'E4CE8F589FF4':
@@ -84,6 +99,9 @@ if __name__ == '__main__':
         tcount += 1
     if macrpr == "'e4:ce:8f:58:9f:f4'":
         tcount += 1
+    mac = MacAddr.fromraw('\xe4\xce\x8f\x58\x9f\xf4')
+    if mac == 'e4:ce:8f:58:9f:f4' and mac is MacAddr.fromraw('\xe4\xce\x8f\x58\x9f\xf4'):
+        tcount += 1
 
     if tcount == ntests:
         print "All tests passed!"
@@ -0,0 +1,205 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Multiple packet trace module
+
+Provides a single stream of packets from multiple trace files ordered by
+their timestamps, e.g., traces captured at the same time on the metadata
+server, on each of the data servers and on every client. Each trace file is
+decoded by its own packet trace object so the state of all TCP streams and
+RPC calls is kept separately for each trace file. The packets are merged as
+they are decoded, keeping a single decoded packet in memory for each trace
+file. Each packet trace object still keeps the packet map and checkpoints
+of its own trace file so the position can be restored, use state=False to
+avoid that when the packets are only iterated once.
+
+Each packet returned has the following attribute to identify its source:
+    tfile = Name of the trace file where the packet came from
+
+The record index of each packet is the packet index within its own trace
+file, the absolute timestamp of each packet is used to order the packets.
+"""
+import heapq
+import parser
+import nfstest_config as c
+from baseobj import BaseObj
+from packet.pktt import Pktt
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+class MultiPktt(BaseObj):
+    """Multiple packet trace object
+
+       Usage:
+           from packet.multipktt import MultiPktt
+
+           x = MultiPktt(["/traces/mds.cap", "/traces/ds1.cap", "/traces/client.cap"])
+
+           # Iterate over all packets found in all trace files
+           for pkt in x:
+               print pkt.tfile, pkt
+    """
+    def __init__(self, tfiles, **kwargs):
+        """Constructor
+
+           Initialize object's private data, none of the trace files are
+           opened until the first packet is retrieved.
+
+           tfiles:
+               List of tcpdump trace file names
+
+           All extra options are passed directly to each packet trace object.
+           The packets are retrieved in order so the packet cache is disabled
+           unless the cache_size option is given, and the trace files are not
+           shared with other packet trace objects unless the shared option
+           is given, see packet.pktt.Pktt.
+        """
+        kwargs.setdefault('cache_size', 0)
+        kwargs.setdefault('shared', False)
+        self.tfiles = list(tfiles)
+        self.pktts  = [Pktt(tfile, **kwargs) for tfile in self.tfiles]
+        self.index  = 0     # Number of packets retrieved so far
+        self.pkt    = None  # Current packet
+        self._heap   = None  # Next packet of each trace file ordered by time
+        self._refill = None  # Trace file of the current packet
+
+    def __iter__(self):
+        """Make this object iterable."""
+        return self
+
+    def _push(self, sindex):
+        """Add the next packet of the given trace file to the heap"""
+        pktt = self.pktts[sindex]
+        try:
+            pkt = pktt.next()
+        except StopIteration:
+            return
+        pkt.tfile = pktt.tfile
+        record = pkt.record
+        tstamp = record.seconds + record.msecs/1000000.0
+        heapq.heappush(self._heap, (tstamp, sindex, pkt))
+
+    def next(self):
+        """Get the next packet from all trace files or raise StopIteration.
+
+           The packet is also stored in the object attribute pkt.
+        """
+        if self._heap is None:
+            # Get the first packet of every trace file
+            self._heap = []
+            for sindex in xrange(len(self.pktts)):
+                self._push(sindex)
+        elif self._refill is not None:
+            # Replace the current packet by the next one from its trace
+            # file, this is deferred so the current packet is still the
+            # current packet of its own packet trace object
+            self._push(self._refill)
+        self._refill = None
+
+        if not self._heap:
+            self.pkt = None
+            raise StopIteration
+        tstamp, sindex, self.pkt = heapq.heappop(self._heap)
+        self._refill = sindex
+        self.index += 1
+        return self.pkt
+
+    def _position(self):
+        """Return the current position: the index of the next packet to
+           retrieve from each trace file and the number of packets
+           retrieved so far.
+        """
+        if self._heap is None:
+            return None
+        pos = [pktt.index for pktt in self.pktts]
+        for tstamp, sindex, pkt in self._heap:
+            pos[sindex] = pkt.record.index
+        return (pos, self.index)
+
+    def _restore(self, position):
+        """Restore the position as returned by _position()
+
+           Each trace file which has moved is rewound to the nearest
+           checkpoint and decoded again up to its position, so it could
+           decode up to one checkpoint interval of packets for each trace
+           file, see packet.pktt.Pktt.rewind().
+        """
+        if position is None:
+            self.rewind()
+            return
+        pos, self.index = position
+        self._heap = []
+        self._refill = None
+        for sindex, pktt in enumerate(self.pktts):
+            if pos[sindex] < pktt.index:
+                pktt.rewind(pos[sindex])
+            self._push(sindex)
+
+    def rewind(self):
+        """Rewind all trace files to their first packet."""
+        self.dprintf('PKT1', ">>> MultiPktt.rewind()")
+        for pktt in self.pktts:
+            pktt.rewind(0)
+        self.index   = 0
+        self.pkt     = None
+        self._heap   = None
+        self._refill = None
+
+    def match(self, expr):
+        """Return the next packet from all trace files that matches the given
+           expression. Returns None if packet is not found and the position
+           of all trace files is restored to where the search started, this
+           needs the state of each packet trace object so the position is
+           not restored when the state option is False.
+
+           expr:
+               String of expressions to be evaluated, see Pktt.match()
+
+           Examples:
+               # Find the next LAYOUTGET reply seen in any trace file
+               pkt = x.match("NFS.resop == 50")
+               if pkt:
+                   print pkt.tfile, pkt.record.index
+        """
+        save_pos = self._position()
+
+        # Parse match expression once, the expression is converted by each
+        # packet trace object since the conversion keeps some state
+        smap = parser.st2list(parser.expr(expr))
+        pdata = [pktt._convert_match(smap) for pktt in self.pktts]
+        self.dprintf('PKT1', ">>> MultiPktt.match(%s)", expr)
+
+        while True:
+            try:
+                pkt = self.next()
+            except StopIteration:
+                break
+            sindex = self._refill
+            try:
+                if eval(pdata[sindex], {}, {'self': self.pktts[sindex]}):
+                    self.dprintf('PKT1', ">>> MultiPktt.match() -> %s: %d", pkt.tfile, pkt.record.index)
+                    return pkt
+            except Exception:
+                pass
+
+        # No packet matched, re-position all trace files back to where
+        # the search started
+        self._restore(save_pos)
+        self.pkt = None
+        self.dprintf('PKT1', ">>> MultiPktt.match() -> False")
+        return None
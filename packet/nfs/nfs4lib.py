@@ -42,6 +42,25 @@ class FancyNFS4Unpacker(nfs4_pack.NFS4Unpacker):
             shift += 32
         return out
 
+    def filter_nfs_fh4(self, data):
+        """Intern filehandle so all packets share a single copy"""
+        return intern(data)
+
+    def filter_stateid4(self, data):
+        """Intern the opaque part of the stateid so all packets share
+           a single copy
+        """
+        data.other = intern(data.other)
+        return data
+
+    def filter_sessionid4(self, data):
+        """Intern session id so all packets share a single copy"""
+        return intern(data)
+
+    def filter_deviceid4(self, data):
+        """Intern device id so all packets share a single copy"""
+        return intern(data)
+
     def filter_fattr4(self, data):
         """Return as dict, instead of opaque attrlist"""
         return fattr2dict(data)
@@ -60,6 +79,39 @@ class FancyNFS4Unpacker(nfs4_pack.NFS4Unpacker):
             data.da_addr_body = u.unpack_nfsv4_1_file_layout_ds_addr4()
         return data
             
+class TimedNFS4Unpacker(FancyNFS4Unpacker):
+    """Unpacker adding the time spent decoding each operation to the
+       given layer timer (packet.profiler.LayerTimer)"""
+    def __init__(self, data, timing):
+        """Initialize unpacker with the data and the layer timer"""
+        FancyNFS4Unpacker.__init__(self, data)
+        self.timing = timing
+
+    def _timed_op(self, unpack, opmap, attr):
+        """Decode operation using the given unpack method and add its time
+           to the timer using the name given by opmap"""
+        stime = self.timing.clock()
+        data = unpack(self)
+        opnum = getattr(data, attr)
+        self.timing.add_op(opmap.get(opnum, str(opnum)), self.timing.clock() - stime)
+        return data
+
+    def unpack_nfs_argop4(self):
+        """Unpack and time NFS operation in the call"""
+        return self._timed_op(FancyNFS4Unpacker.unpack_nfs_argop4, nfs4_const.nfs_opnum4, 'argop')
+
+    def unpack_nfs_resop4(self):
+        """Unpack and time NFS operation in the reply"""
+        return self._timed_op(FancyNFS4Unpacker.unpack_nfs_resop4, nfs4_const.nfs_opnum4, 'resop')
+
+    def unpack_nfs_cb_argop4(self):
+        """Unpack and time NFS callback operation in the call"""
+        return self._timed_op(FancyNFS4Unpacker.unpack_nfs_cb_argop4, nfs4_const.nfs_cb_opnum4, 'argop')
+
+    def unpack_nfs_cb_resop4(self):
+        """Unpack and time NFS callback operation in the reply"""
+        return self._timed_op(FancyNFS4Unpacker.unpack_nfs_cb_resop4, nfs4_const.nfs_cb_opnum4, 'resop')
+
 def fattr2dict(obj):
     """Convert a fattr4 object to a dictionary with attribute name and values.
 
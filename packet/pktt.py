@@ -36,17 +36,27 @@ Packet layers supported:
 import os
 import re
 import gzip
+import bisect
 import time
 import token
+import weakref
 import struct
 import parser
 import symbol
 import nfstest_config as c
+from collections import OrderedDict
 from baseobj import BaseObj
 from packet.pkt import Pkt
 from packet.unpack import Unpack
+from packet.frame import pkt_frame, frame_match
 from packet.record import Record
+from packet.prefetch import Prefetch
+from packet.profiler import profiled, LayerTimer
+from packet.sample import PktSample
+from packet.summary import ChunkSummary, summary_filter
+from packet.tracedb import TraceDB
 from packet.link.ethernet import ETHERNET
+from packet.application.rpc_const import CALL
 
 # Module constants
 __author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
@@ -60,6 +70,37 @@ BaseObj.debug_map(0x400000000, 'pkt3', "PKT3: ")
 BaseObj.debug_map(0x800000000, 'pkt4', "PKT4: ")
 BaseObj.debug_map(0xF00000000, 'pktt', "PKTT: ")
 
+# Number of packets between checkpoints, a checkpoint saves the state of all
+# TCP streams so rewind() does not have to start from the first packet
+_checkpoint_interval = 256
+# Number of checkpoints between full checkpoints, any other checkpoint saves
+# only the TCP streams which have changed since the previous checkpoint
+_checkpoint_full = 256
+# Number of packets in each chunk summary, it must be a multiple of the
+# checkpoint interval so a skipped chunk ends on a checkpoint
+_chunk_interval = 256 * _checkpoint_interval
+# Default maximum number of bytes of all packets in the packet cache
+_cache_size = 8 * 1024 * 1024
+# Default maximum number of results in the match cache
+_match_cache_size = 1024
+# Attributes shared between a packet trace object and all its cursors
+_shared_attrs = ['pkt_map', 'pkt_times', 'tstart', 'header', 'header_fmt', 'header_rec',
+                 'ident', '_checkpoints', '_summaries', '_rpc_xid_map',
+                 'frame', '_pkt_cache', '_match_cache', 'counters']
+# Number of bytes copied at a time by write()
+_copy_size = 1024 * 1024
+# Names of the capture health counters, see stats()
+_counter_names = ('truncated', 'retransmissions', 'resyncs', 'nfs_errors',
+                  'ethernet_bytes', 'ip_bytes', 'tcp_bytes', 'rpc_bytes', 'nfs_bytes')
+# Default maximum number of calls waiting for their reply in pairs()
+_pairs_maxsize = 65536
+# Number of seconds between checks for more data while waiting
+_ready_poll = 0.01
+# Trace registry: attributes shared by all packet trace objects opening the
+# same trace file within this process, keyed by (realpath, size, mtime).
+# A trace file is removed from the registry as soon as no packet trace
+# object using it is left
+_trace_registry = weakref.WeakValueDictionary()
 # Map of tokens
 _token_map = dict(token.tok_name.items() + symbol.sym_name.items())
 # Map of items not in the array of the compound
@@ -75,6 +116,119 @@ _match_func_map = {
 
 class Header(BaseObj): pass
 
+class SharedState(dict):
+    """Attributes shared by all packet trace objects opening the same
+       trace file, each object keeps a reference to it while using the
+       trace file so it stays in the trace registry.
+    """
+    pass
+
+class PktCache(object):
+    """Least recently used cache of decoded packets keyed by packet index.
+       The size of the cache is given by the number of bytes captured for
+       all the packets in the cache, that is, by their record length_inc.
+    """
+    def __init__(self, maxsize=_cache_size):
+        """Constructor
+
+           Initialize object's private data.
+
+           maxsize:
+               Maximum number of bytes of all packets in the cache
+        """
+        self.maxsize = maxsize
+        self.size    = 0
+        self.pkts    = OrderedDict()
+
+    def __len__(self):
+        """Return the number of packets in the cache"""
+        return len(self.pkts)
+
+    def get(self, index):
+        """Return the packet given by index or None if it is not cached"""
+        pkt = self.pkts.pop(index, None)
+        if pkt is not None:
+            # Packet is now the most recently used
+            self.pkts[index] = pkt
+        return pkt
+
+    def add(self, pkt):
+        """Add packet to the cache, remove the least recently used packets
+           until the size of the cache is within its maximum size
+        """
+        index = pkt.record.index
+        old = self.pkts.pop(index, None)
+        if old is not None:
+            self.size -= old.record.length_inc
+        self.pkts[index] = pkt
+        self.size += pkt.record.length_inc
+        while self.size > self.maxsize and self.pkts:
+            index, old = self.pkts.popitem(last=False)
+            self.size -= old.record.length_inc
+
+    def clear(self):
+        """Remove all packets from the cache"""
+        self.pkts.clear()
+        self.size = 0
+
+class MatchCache(object):
+    """Least recently used cache of match results keyed by the converted
+       match expression, the packet index where the search starts and the
+       search limits. Each result is the index of the matched packet or
+       None if no packet matched.
+    """
+    def __init__(self, maxsize=_match_cache_size):
+        """Constructor
+
+           Initialize object's private data.
+
+           maxsize:
+               Maximum number of results in the cache
+        """
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+
+    def __len__(self):
+        """Return the number of results in the cache"""
+        return len(self.results)
+
+    def __contains__(self, key):
+        """Return True if the result given by key is cached"""
+        return key in self.results
+
+    def get(self, key):
+        """Return the result given by key, the key must be in the cache"""
+        index = self.results.pop(key)
+        # Result is now the most recently used
+        self.results[key] = index
+        return index
+
+    def add(self, key, index):
+        """Add result to the cache, remove the least recently used result
+           if the cache is full
+        """
+        self.results.pop(key, None)
+        self.results[key] = index
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        """Remove all results from the cache"""
+        self.results.clear()
+
+class RPCMessage(BaseObj):
+    """RPC message object
+
+       Attributes:
+           pkt   = Packet where the RPC message ends, it has all the layers
+                   of the RPC message
+           rpc   = RPC layer object
+           nfs   = NFS layer object, None if the message is not NFS
+           first = Index of the packet where the RPC message starts
+           last  = Index of the packet where the RPC message ends
+    """
+    pass
+
 class Pktt(BaseObj, Unpack):
     """Packet trace object
 
@@ -87,7 +241,8 @@ class Pktt(BaseObj, Unpack):
            for pkt in x:
                print pkt
     """
-    def __init__(self, tfile, live=False, state=True):
+    def __init__(self, tfile, live=False, state=True, cache_size=_cache_size, prefetch=0,
+                 match_cache=_match_cache_size, profiler=None, timing=False, shared=True):
         """Constructor
 
            Initialize object's private data, note that this will not check the
@@ -95,6 +250,12 @@ class Pktt(BaseObj, Unpack):
            tcpdump file. The tcpdump trace file will be opened the first time a
            packet is retrieved.
 
+           All packet trace objects opening the same unmodified trace file
+           within the process share the packet map, checkpoints, chunk
+           summaries and RPC call information, so a trace file opened again
+           is not processed again from scratch while any packet trace object
+           using it is still alive, see clear_registry().
+
            tracefile:
                Name of tcpdump trace file (little or big endian format)
            live:
@@ -105,9 +266,41 @@ class Pktt(BaseObj, Unpack):
                case when <EOF> is encountered the next trace file created by
                tcpdump will be opened and the object will be re-initialized,
                all private data referencing the previous file is lost.
+           state:
+               If set to False, no state is kept so the trace file cannot
+               be rewound
+           cache_size:
+               Maximum number of bytes of all packets kept in the packet
+               cache, set it to 0 to disable the cache. The cache is not
+               used when state is False.
+           prefetch:
+               Number of records to read ahead of the current packet using
+               a reader thread, set it to 0 to disable the reader thread.
+               The reader thread is not used when live is True. It is
+               mostly useful for compressed trace files or trace files on
+               slow storage.
+           match_cache:
+               Maximum number of results kept in the match cache, set it to
+               0 to disable the cache. The cache is not used when state is
+               False, see match().
+           profiler:
+               Record all match() and rewind() calls in the given profiler,
+               see packet.profiler.MatchProfiler [default: None]
+           timing:
+               Time the decoding of each packet layer and of each NFS
+               operation, see stats() [default: False]
+           shared:
+               If set to False, the trace file is not shared with other
+               packet trace objects opening the same trace file, nothing
+               processed by either one is re-used by the other [default: True]
         """
         self.tfile   = tfile  # Current trace file name
         self.bfile   = tfile  # Base trace file name
+        # Constructor options, the same options are used when the object
+        # is re-initialized for the next live trace file
+        self._options = dict(live=live, state=state, cache_size=cache_size, prefetch=prefetch,
+                             match_cache=match_cache, profiler=profiler, timing=timing,
+                             shared=shared)
         self.live    = live   # Set to True if dealing with a live tcpdump file
         self.state   = state  # Set to False so state is not kept,
                               # use for large trace files to save some memory
@@ -118,6 +311,50 @@ class Pktt(BaseObj, Unpack):
         self.fh      = None   # Current file handle
         self.pkt     = None   # Current packet
         self.pkt_map = []     # Packet map: pkt_map[self.index] = self.offset
+        self.pkt_times = []   # Packet times: pkt_times[self.index] = record.secs
+        self.frame   = None   # Packet frame, see to_frame()
+        self.tracedb = None   # Trace database, see open_db()
+        self.shared  = shared # Share the trace file with other objects
+        self.tkey    = None   # Key of the trace file in the trace registry
+        self._shared = None   # Entry of the trace file in the trace registry
+        self.prefetch = prefetch  # Number of records to read ahead
+        self.profiler = profiler  # Profiler of match() and rewind() calls
+        self.timing  = LayerTimer() if timing else None  # Layer timer
+        # Capture health counters, each packet is counted only the first
+        # time it is processed
+        self.counters = dict.fromkeys(_counter_names, 0)
+        self._isnew   = False  # Current packet is processed for the first time
+
+        # Reader thread object, created the first time a packet is fetched
+        self._prefetch = None
+
+        # List of checkpoints: state of the TCP streams at the start of
+        # packet index N*_checkpoint_interval, where N is the list index,
+        # see _checkpoint_state()
+        self._checkpoints = []
+        # Last checkpoint state used as (list index, state of all TCP streams)
+        self._cstate = None
+        # List of chunk summaries: summary of all packets starting at packet
+        # index N*_chunk_interval, where N is the list index
+        self._summaries = []
+
+        # Cache of the most recently used packets, see __getitem__()
+        self._pkt_cache = None
+        if state and cache_size > 0:
+            self._pkt_cache = PktCache(cache_size)
+        # Cache of the results of the most recently used match expressions
+        self._match_cache = None
+        if state and match_cache > 0:
+            self._match_cache = MatchCache(match_cache)
+        # Actual packet index of the file pointer when the current packet
+        # index has been changed by a packet cache hit, otherwise None
+        self._reposition = None
+        # Previous packet and the rest of its TCP segment data when the
+        # segment has more RPC packets to decode, otherwise None
+        self._tcp_cont = None
+
+        # RPC xid map: to keep track of the call information for each xid
+        self._rpc_xid_map = {}
 
         # TCP stream map: to keep track of the different TCP streams within
         # the trace file -- used to deal with RPC packets spanning multiple
@@ -129,6 +366,8 @@ class Pktt(BaseObj, Unpack):
 
            Gracefully close the tcpdump trace file if it is opened.
         """
+        if self._prefetch:
+            self._prefetch.stop()
         if self.fh:
             self.fh.close()
 
@@ -159,10 +398,16 @@ class Pktt(BaseObj, Unpack):
 
            The packet is also stored in the object attribute pkt.
 
+           The most recently used packets are kept in the packet cache,
+           a packet found in the cache is returned without decoding it
+           again. The packet index is still moved to the next packet after
+           the one returned, but the file pointer is only positioned when
+           the next packet is fetched from the trace file.
+
            Examples:
                pkt = x[index]
         """
-        self.dprint('PKT4', ">>> __getitem__(%d)" % index)
+        self.dprintf('PKT4', ">>> __getitem__(%d)", index)
         if index < 0:
             # No negative index is allowed
             raise IndexError
@@ -174,10 +419,25 @@ class Pktt(BaseObj, Unpack):
         except:
             pass
 
-        if index < self.index and index < len(self.pkt_map):
+        if self._pkt_cache is not None:
+            pkt = self._pkt_cache.get(index)
+            if pkt is not None:
+                # The requested packet is in the cache
+                self.dprintf('PKT4', "    %d: packet cache hit", index)
+                if self.profiler is not None:
+                    self.profiler.cached += 1
+                if self._reposition is None:
+                    self._reposition = self.index
+                self.pkt = pkt
+                self.index = index + 1
+                return pkt
+
+        if index < len(self.pkt_map) and \
+           (index < self.index or index - self.index > _checkpoint_interval):
             # Reset the current packet index and offset
-            # The index is less than the current packet offset so position
-            # the file pointer to the offset of the packet given by index
+            # The index is less than the current packet offset or far ahead
+            # of it so position the file pointer to the offset of the packet
+            # given by index starting from the nearest checkpoint
             self.rewind(index)
 
         # Move to the packet specified by the index
@@ -222,32 +482,77 @@ class Pktt(BaseObj, Unpack):
                        break
 
            NOTE:
-               Supports only single active iteration
+               Supports only single active iteration, use cursor() to have
+               multiple independent iterations over the same trace file
         """
-        self.dprint('PKT4', ">>> %d: next()" % self.index)
+        self.dprintf('PKT4', ">>> %d: next()", self.index)
+        # Open the trace file if necessary
+        self._getfh()
+        if self._reposition is not None:
+            # The packet index has been changed by a packet cache hit,
+            # position the file pointer to the packet given by the index
+            index = self.index
+            self.index = self._reposition
+            self._reposition = None
+            self._seek_index(index)
         # Initialize next packet
         self.pkt = Pkt()
 
         # Save file offset for this packet
         self.b_offset = self.offset
-        if self.state and self.index >= len(self.pkt_map):
+        # First time this packet is processed, the time of every packet
+        # processed is saved, including the first packet whose offset is
+        # already in the packet map when the trace file is opened
+        isnew = self.state and self.index == len(self.pkt_times)
+        if isnew and self.index >= len(self.pkt_map):
             self.pkt_map.append(self.offset)
+            if self.index == len(self._checkpoints)*_checkpoint_interval:
+                # Save the state of all TCP streams
+                self._add_checkpoint()
+        # Without state every packet is processed only once
+        self._isnew = isnew or not self.state
+
+        if self._prefetch is None and self.prefetch > 0 and not self.live:
+            # Start reading records ahead of the current packet
+            self._prefetch = Prefetch(self.tfile, self.header_rec, self.prefetch)
 
-        # Get record header
+        # Get record header and data
         rec_keys = ('seconds', 'msecs', 'length_inc', 'length_orig')
-        header = self._read(16)
-        if len(header) < 16:
-            raise StopIteration
-        self.pkt.record = Record(rec_keys, struct.unpack(self.header_rec, header))
+        if self._tcp_cont is not None:
+            # Next RPC packet within the TCP segment of the previous packet,
+            # the record is not read again and the lower layers are shared
+            # with the previous packet
+            ppkt, data = self._tcp_cont
+            self._tcp_cont = None
+            rec = ppkt.record
+            self.pkt.record = Record(rec_keys, (rec.seconds, rec.msecs, rec.length_inc, rec.length_orig))
+            self.pkt.record.secs = rec.secs
+            self.pkt.record.index = self.index
+            self.offset += 16 + rec.length_inc
+            self.pkt.ethernet = ppkt.ethernet
+            self.pkt.ip = ppkt.ip
+            ppkt.tcp._continue(self, data)
+            return self._next_done(isnew)
+        elif self._prefetch is not None:
+            header, self.data = self._prefetch.get(self.offset)
+            self.offset += len(header) + len(self.data)
+            self.pkt.record = Record(rec_keys, struct.unpack(self.header_rec, header))
+        else:
+            header = self._read(16)
+            if len(header) < 16:
+                raise StopIteration
+            self.pkt.record = Record(rec_keys, struct.unpack(self.header_rec, header))
+            self.data = self._read(self.pkt.record.length_inc)
+            if len(self.data) < self.pkt.record.length_inc:
+                raise StopIteration
         secs = float(self.pkt.record.seconds) + float(self.pkt.record.msecs)/1000000.0
         if self.tstart is None:
             self.tstart = secs
+            self._register()
         self.pkt.record.secs = secs - self.tstart
-
-        # Get the data
-        self.data = self._read(self.pkt.record.length_inc)
-        if len(self.data) < self.pkt.record.length_inc:
-            raise StopIteration
+        if self._isnew and self.pkt.record.length_inc < self.pkt.record.length_orig:
+            # Packet was truncated by the capture
+            self.counters['truncated'] += 1
 
         if self.header.link_type == 1:
             # Decode ethernet layer
@@ -258,35 +563,93 @@ class Pktt(BaseObj, Unpack):
 
         # Save record index
         self.pkt.record.index = self.index
+        return self._next_done(isnew)
+
+    def _next_done(self, isnew):
+        """Finish processing the current packet and return it, the packet
+           index is incremented.
+
+           isnew:
+               The packet is processed for the first time
+        """
+        if self.profiler is not None:
+            self.profiler.decoded += 1
+        if isnew:
+            # Save the time of the packet to search packets by time
+            self.pkt_times.append(self.pkt.record.secs)
+            # Add packet to the chunk summary
+            cindex = self.pkt.record.index / _chunk_interval
+            if cindex == len(self._summaries):
+                self._summaries.append(ChunkSummary(cindex * _chunk_interval))
+            self._summaries[cindex].add(self.pkt)
 
         # Increment packet index
         self.index += 1
         if self.index > self.mindex:
             self.mindex = self.index
+        if self._pkt_cache is not None:
+            self._pkt_cache.add(self.pkt)
+        if isnew and self.live and self._match_cache:
+            # The trace file has grown, a cached search could now match
+            # a different packet
+            self._match_cache.clear()
 
         return self.pkt
 
+    @profiled
     def rewind(self, index=0):
         """Rewind the trace file by setting the file pointer to the start of
            the given packet index. Returns False if unable to rewind the file,
            e.g., when the given index is greater than the maximum number
            of packets processed so far.
         """
-        self.dprint('PKT1', ">>> rewind(%d)" % index)
+        self.dprintf('PKT1', ">>> rewind(%d)", index)
+        if index > 0 and not self.pkt_map:
+            # Open the trace file, the packet map could be already known
+            # from another packet trace object opening the same trace file
+            self._getfh()
         if index >= 0 and index < len(self.pkt_map):
-            # Reset the current packet index and offset to the first packet
-            self.offset = self.pkt_map[0]
-            self.index = 0
-
-            # Position the file pointer to the offset of the first packet
+            # Reset the current packet index and offset to the nearest
+            # checkpoint before the given index
+            cindex = index / _checkpoint_interval
+            if cindex < len(self._checkpoints):
+                self.index = cindex * _checkpoint_interval
+                sstate = self._checkpoint_state(cindex)
+            else:
+                self.index = 0
+                sstate = {}
+            self.offset = self.pkt_map[self.index]
+            self._reposition = None
+            self._tcp_cont = None
+            if self.profiler is not None:
+                self.profiler.rewinds += 1
+            if self._prefetch:
+                # Records are read again starting at the new offset
+                self._prefetch.stop()
+
+            # Position the file pointer to the offset of the packet
             self._getfh().seek(self.offset)
 
-            # Clear stream fragments
+            # Restore the state of all TCP streams, clear stream fragments
+            # for all streams not found in the checkpoint
             for stream_key in self._tcp_stream_map:
-                stream = self._tcp_stream_map[stream_key]
-                stream['last_seq'] = 0
-                stream['frag_off'] = 0
-                stream['msfrag'] = ''
+                if stream_key not in sstate:
+                    stream = self._tcp_stream_map[stream_key]
+                    stream['last_seq'] = 0
+                    stream['frag_off'] = 0
+                    stream['msfrag'] = ''
+            for stream_key in sstate:
+                stream = self._tcp_stream_map.get(stream_key)
+                if stream is None:
+                    # Stream has not been seen by this object, e.g., a cursor
+                    stream = {'smap': {}}
+                    self._tcp_stream_map[stream_key] = stream
+                sinfo = sstate[stream_key]
+                stream['seq_base'] = sinfo[0]
+                stream['last_seq'] = sinfo[1]
+                stream['frag_off'] = sinfo[2]
+                stream['msfrag']   = sinfo[3]
+                stream['pindex']   = sinfo[4]
 
             # Move to the packet before the specified by the index so the
             # next packet fetched will be the one given by index
@@ -299,6 +662,164 @@ class Pktt(BaseObj, Unpack):
             return True
         return False
 
+    def _seek_index(self, index):
+        """Position the trace file so the next packet fetched will be the
+           one given by index, raise StopIteration if index is beyond the
+           end of the trace file.
+        """
+        if index < self.index or index - self.index > _checkpoint_interval:
+            # Start from the nearest checkpoint
+            self.rewind(min(index, len(self.pkt_map)-1))
+        # Move forward to the packet before the specified by the index
+        while self.index < index:
+            self.next()
+
+    def _time_index(self, mintime=None, maxtime=None):
+        """Return the tuple (start, end) of packet indexes for the given time
+           window using the times of all packets processed so far, where
+           start is the index of the first packet at or after mintime and
+           end is the index of the first packet after maxtime. Either index
+           is None if the time is not given or, for end, if no packet after
+           maxtime has been processed yet.
+        """
+        start = None
+        end = None
+        if mintime is not None:
+            start = bisect.bisect_left(self.pkt_times, mintime)
+        if maxtime is not None:
+            end = bisect.bisect_right(self.pkt_times, maxtime)
+            if end == len(self.pkt_times):
+                end = None
+        return (start, end)
+
+    def seek_time(self, secs):
+        """Position the trace file so the next packet fetched is the first
+           packet at or after the given time, the packets processed so far
+           are found using a binary search on their times. Returns False if
+           there is no packet at or after the given time, the position in the
+           trace file is not changed in this case.
+
+           secs:
+               Time in seconds relative to the first packet
+
+           Examples:
+               # Process all packets captured after the first minute
+               if x.seek_time(60):
+                   for pkt in x:
+                       print pkt
+        """
+        self.dprintf('PKT1', ">>> seek_time(%f)", secs)
+        self._getfh()
+        index = bisect.bisect_left(self.pkt_times, secs)
+        if index == len(self.pkt_times):
+            # Process the packets after the ones processed so far
+            save_index = self.index
+            try:
+                self._seek_index(index)
+                while True:
+                    pkt = self.next()
+                    if pkt.record.secs >= secs:
+                        index = pkt.record.index
+                        break
+            except StopIteration:
+                self.rewind(save_index)
+                return False
+        return self.rewind(index)
+
+    def cursor(self, start=None):
+        """Return a new packet trace object for the same trace file having
+           its own file position and current packet, so it can be used to
+           search the trace file without changing the position of this
+           object. The cursor shares the packet map, checkpoints, chunk
+           summaries, RPC call information, packet frame and trace database
+           with this object so nothing already processed is decoded again
+           just to find its way in the trace file.
+
+           start:
+               Packet index where the cursor starts [default: the current
+               packet index of this object]
+
+           Examples:
+               # Find the reply of each READ request without having to
+               # rewind the outer iteration
+               while x.match("NFS.argop == 25"):
+                   xid = x.pkt.rpc.xid
+                   pkt_reply = x.cursor().match("RPC.xid == %d" % xid)
+
+           NOTE:
+               The cursor does not follow a live trace file
+        """
+        # Make sure the trace file has been opened
+        self._getfh()
+        cursor = Pktt(self.tfile, state=self.state, profiler=self.profiler, shared=self.shared)
+        cursor.timing = self.timing
+        cursor.tracedb = self.tracedb
+        cursor._shared = self._shared
+        for attr in _shared_attrs:
+            setattr(cursor, attr, getattr(self, attr))
+        cursor.mindex = self.mindex
+        # Open the trace file for the cursor
+        cursor._getfh()
+        if start is None:
+            start = self.index
+        try:
+            cursor._seek_index(start)
+        except StopIteration:
+            pass
+        return cursor
+
+    def _stream_state(self):
+        """Return the state of all TCP streams needed to resume decoding
+           at the current packet.
+        """
+        sstate = {}
+        for stream_key in self._tcp_stream_map:
+            stream = self._tcp_stream_map[stream_key]
+            sstate[stream_key] = (stream['seq_base'], stream['last_seq'],
+                                  stream['frag_off'], stream['msfrag'],
+                                  stream['pindex'])
+        return sstate
+
+    def _add_checkpoint(self):
+        """Add a checkpoint for the current packet, a full checkpoint has
+           the state of all TCP streams while any other checkpoint has only
+           the streams which have changed since the previous checkpoint
+           (a stream set to None is no longer in the TCP stream map).
+        """
+        sstate = self._stream_state()
+        cindex = len(self._checkpoints)
+        if cindex % _checkpoint_full:
+            pstate = self._checkpoint_state(cindex - 1)
+            delta = {}
+            for stream_key in sstate:
+                if pstate.get(stream_key) != sstate[stream_key]:
+                    delta[stream_key] = sstate[stream_key]
+            for stream_key in pstate:
+                if stream_key not in sstate:
+                    delta[stream_key] = None
+            self._checkpoints.append(delta)
+        else:
+            self._checkpoints.append(sstate)
+        self._cstate = (cindex, sstate)
+
+    def _checkpoint_state(self, cindex):
+        """Return the state of all TCP streams at the given checkpoint, it
+           is given by the nearest full checkpoint before it followed by all
+           the changes saved in the checkpoints in between.
+        """
+        if self._cstate is not None and self._cstate[0] == cindex:
+            return self._cstate[1]
+        findex = cindex - cindex % _checkpoint_full
+        sstate = dict(self._checkpoints[findex])
+        for delta in self._checkpoints[findex+1:cindex+1]:
+            for stream_key in delta:
+                if delta[stream_key] is None:
+                    sstate.pop(stream_key, None)
+                else:
+                    sstate[stream_key] = delta[stream_key]
+        self._cstate = (cindex, sstate)
+        return sstate
+
     def _getfh(self):
         """Get the filehandle of the trace file, open file if necessary."""
         if self.fh == None:
@@ -342,13 +863,71 @@ class Pktt(BaseObj, Unpack):
             head_keys = ('major', 'minor', 'zone_offset', 'accuracy', 'dump_length', 'link_type')
             self.header = Header(head_keys, struct.unpack(self.header_fmt, self._read(20)))
 
-            # Initialize packet number
-            self.index = 0
-            self.pkt_map = [self.offset]
-            self.tstart = None
+            if self.state and self.shared and not self.live:
+                # Trace file can be shared with other packet trace objects
+                self.tkey = (os.path.realpath(self.tfile), fstat.st_size, fstat.st_mtime)
+
+            if not self.pkt_map:
+                # Initialize packet number, the packet map is already
+                # initialized when the packet trace is shared with a cursor
+                self.index = 0
+                shared = _trace_registry.get(self.tkey)
+                if shared is not None:
+                    # Trace file has already been opened by another packet
+                    # trace object, re-use everything processed so far
+                    self.dprintf('PKT1', ">>> using shared trace state")
+                    self._shared = shared
+                    for attr in _shared_attrs:
+                        if attr in ('_pkt_cache', '_match_cache') and \
+                           None in (getattr(self, attr), shared[attr]):
+                            # Cache is disabled for either object
+                            continue
+                        setattr(self, attr, shared[attr])
+                    self.mindex = len(self.pkt_map) - 1
+                else:
+                    self.pkt_map.append(self.offset)
+                    # No TCP streams have been seen at the first packet
+                    self._checkpoints.append({})
+                    self.tstart = None
+                    self._register()
 
         return self.fh
 
+    def _register(self):
+        """Add the attributes shared with other packet trace objects to the
+           trace registry so they are re-used by any packet trace object
+           opening the same trace file.
+        """
+        if self.tkey is None:
+            return
+        shared = _trace_registry.get(self.tkey)
+        if shared is None:
+            shared = SharedState()
+            _trace_registry[self.tkey] = shared
+        shared.update((attr, getattr(self, attr)) for attr in _shared_attrs)
+        self._shared = shared
+
+    @staticmethod
+    def clear_registry():
+        """Remove all trace files from the trace registry, packet trace
+           objects created afterwards will process their trace files from
+           scratch.
+
+           Examples:
+               # Call as a class
+               Pktt.clear_registry()
+        """
+        _trace_registry.clear()
+
+    def _rawfh(self):
+        """Return a new file handle for the trace file, independent of the
+           file handle used to decode the packets.
+        """
+        if isinstance(self._getfh(), gzip.GzipFile):
+            # Open it by name so closing it also closes the underlying file
+            return gzip.GzipFile(self.tfile, 'rb')
+        return open(self.tfile, 'rb')
+
     def _read(self, count):
         """Wrapper for read in order to increment the object's offset. It also
            takes care of <EOF> when 'live' option is set which keeps on trying
@@ -366,12 +945,21 @@ class Pktt(BaseObj, Unpack):
                     # Save information that keeps track of the next trace file
                     basefile = self.bfile
                     findex = self.findex + 1
-                    # Re-initialize the object
+                    # Re-initialize the object, keeping the packet being
+                    # fetched so it is read from the next trace file
+                    pkt = self.pkt
                     self.__del__()
-                    self.__init__(tracefile, live=self.live)
+                    timing = self.timing
+                    self.__init__(tracefile, **self._options)
+                    self.timing = timing
+                    self.pkt = pkt
                     # Overwrite next trace file info
                     self.bfile = basefile
                     self.findex = findex
+                    # Read from the next trace file right away
+                    self._getfh().seek(self.offset)
+                    self.b_offset = self.offset
+                    continue
                 # Re-position file pointer to last known offset
                 self._getfh().seek(self.offset)
                 time.sleep(1)
@@ -382,6 +970,29 @@ class Pktt(BaseObj, Unpack):
         self.offset += ldata
         return data
 
+    def _skip_chunks(self, sfilter):
+        """Move to the first packet of the next chunk which could have a
+           matching packet, starting with the chunk of the current packet.
+           Only chunks which have been fully processed can be skipped.
+
+           sfilter:
+               Function returning False if the chunk summary given as its
+               argument cannot have any matching packets
+        """
+        cindex = self.index / _chunk_interval
+        index = self.index
+        while cindex < len(self._summaries):
+            summary = self._summaries[cindex]
+            nindex = (cindex + 1) * _chunk_interval
+            if summary.count < _chunk_interval or nindex >= len(self.pkt_map) \
+               or sfilter(summary):
+                break
+            cindex += 1
+            index = nindex
+        if index != self.index:
+            self.dprintf('PKT2', "    skipping packets %d-%d", self.index, index-1)
+            self.rewind(index)
+
     def _split_match(self, args):
         """Split match arguments and return a tuple (lhs, opr, rhs)
            where lhs is the left hand side of the given argument expression,
@@ -453,7 +1064,7 @@ class Pktt(BaseObj, Unpack):
         lhs, opr, rhs = self._split_match(args)
         expr = self._process_match(obj, lhs, opr, rhs)
         texpr = eval(expr)
-        self.dprint('PKT2', "    %d: match_%s(%s) -> %r" % (self.pkt.record.index, layer, args, texpr))
+        self.dprintf('PKT2', "    %d: match_%s(%s) -> %r", self.pkt.record.index, layer, args, texpr)
         return texpr
 
     def match_ethernet(self, args):
@@ -603,7 +1214,7 @@ class Pktt(BaseObj, Unpack):
            operation.
         """
         texpr = self._match_nfs(args)
-        self.dprint('PKT2', "    %d: match_nfs(%s) -> %r" % (self.pkt.record.index, args, texpr))
+        self.dprintf('PKT2', "    %d: match_nfs(%s) -> %r", self.pkt.record.index, args, texpr)
         return texpr
 
     def _convert_match(self, ast):
@@ -658,7 +1269,84 @@ class Pktt(BaseObj, Unpack):
 
         return ret
 
-    def match(self, expr, maxindex=None):
+    def _match_reverse(self, pdata, expr, minindex=None, maxindex=None):
+        """Return the last packet before the current packet that matches the
+           given parsed expression or None if no packet matches. The packets
+           are decoded forward one checkpoint interval at a time, starting
+           with the interval having the current packet, so each packet is
+           decoded with the state of all TCP streams restored from the
+           checkpoint at the start of its interval.
+
+           pdata:
+               Parsed match expression as returned by _convert_match()
+           expr:
+               String of expressions used for the packet frame and the
+               chunk summaries
+           minindex:
+               Search packets having an index greater than or equal to
+               this index [default: None, search until the first packet]
+           maxindex:
+               Search packets having an index less than this index
+               [default: None, search from the current packet]
+        """
+        minindex = minindex or 0
+        # Search packets having an index less than this index
+        end = self.index - 1
+        if maxindex is not None:
+            end = min(end, maxindex)
+        if end <= minindex:
+            return None
+
+        if self.frame is not None and self.state and not self.live:
+            # Get the list of candidate packets from the packet frame
+            idxlist = frame_match(self.frame, expr, minindex, end)
+            if idxlist is not None:
+                for index in reversed(idxlist):
+                    pkt = self[index]
+                    try:
+                        if eval(pdata):
+                            return pkt
+                    except Exception:
+                        pass
+                return None
+
+        # Function to check if a chunk of packets could have a match
+        sfilter = summary_filter(expr) if self._summaries else None
+        while end > minindex:
+            start = max((end - 1) / _checkpoint_interval * _checkpoint_interval, minindex)
+            cindex = start / _chunk_interval
+            if sfilter is not None and cindex < len(self._summaries) and \
+               not sfilter(self._summaries[cindex]):
+                # Skip the chunk since it cannot have a matching packet
+                self.dprintf('PKT2', "    skipping packets %d-%d", cindex * _chunk_interval, end-1)
+                end = max(cindex * _chunk_interval, minindex)
+                continue
+
+            # Find the last matching packet in this interval
+            self.rewind(start)
+            found = None
+            while self.index < end:
+                pkt = self.next()
+                try:
+                    if eval(pdata):
+                        found = pkt
+                except Exception:
+                    pass
+            if found is not None:
+                index = found.record.index
+                if index + 1 != self.index:
+                    # Make the packet index point to the next packet after
+                    # the matched packet, the file pointer is re-positioned
+                    # on the next call to next()
+                    self._reposition = self.index
+                    self.index = index + 1
+                    self.pkt = found
+                return found
+            end = start
+        return None
+
+    @profiled
+    def match(self, expr, maxindex=None, reverse=False, mintime=None, maxtime=None, minindex=None):
         """Return the packet that matches the given expression, also the packet
            index points to the next packet after the matched packet.
            Returns None if packet is not found and the packet index points
@@ -667,7 +1355,40 @@ class Pktt(BaseObj, Unpack):
            expr:
                String of expressions to be evaluated
            maxindex:
-               The match fails if packet index hits this limit
+               The match fails if packet index hits this limit, it cannot
+               be given when searching backwards, use minindex instead
+           reverse:
+               Search backwards for the last packet that matches, starting
+               with the packet before the current packet (the packet
+               returned by the last call to next() or match())
+               [default: False]
+           mintime:
+               Search only packets at or after this time in seconds relative
+               to the first packet [default: None]
+           maxtime:
+               Search only packets at or before this time in seconds relative
+               to the first packet [default: None]
+           minindex:
+               Search only packets having an index greater than or equal to
+               this index, this is the limit when searching backwards
+               [default: None]
+
+           The packets outside the time window given by mintime and maxtime
+           are not decoded if they have been processed before, see also
+           seek_time(). The packets are assumed to be ordered by time.
+
+           If the packet frame has been built using to_frame() and the
+           expression can be expressed using the frame fields, the frame
+           is used to get the list of candidate packets so only those
+           packets are decoded. Any term which cannot be expressed using the
+           frame fields is still verified on the candidate packets.
+
+           The result of each search is kept in the match cache, keyed by
+           the parsed expression, the packet index where the search starts
+           and the search limits, so the same search done again from the
+           same packet, e.g., after a rewind(), just gets the matched packet
+           given by its index. The match cache is cleared whenever new
+           packets are added to a live trace file.
 
            Examples:
                # Find the packet with both the ACK and SYN TCP flags set to 1
@@ -704,9 +1425,24 @@ class Pktt(BaseObj, Unpack):
                if ("NFS.argop == 38" in x):
                    print x.pkt.nfs
 
+               # Find the LAYOUTGET request sent before the current packet
+               pkt = x.match("NFS.argop == 50", reverse=True)
+
+               # Same as above, but only searching back to packet 100
+               pkt = x.match("NFS.argop == 50", reverse=True, minindex=100)
+
+               # Find a WRITE request sent within two seconds after
+               # the OPEN request
+               pkt = x.match("NFS.argop == 18")
+               if pkt:
+                   pkt = x.match("NFS.argop == 38", maxtime=pkt.record.secs+2)
+
            See also:
                match_ethernet(), match_ip(), match_tcp(), match_rpc(), match_nfs()
         """
+        if reverse and maxindex is not None:
+            raise Exception("Option maxindex is not valid when searching backwards, use minindex instead")
+
         # Save current position
         save_index = self.index
 
@@ -714,27 +1450,822 @@ class Pktt(BaseObj, Unpack):
         st = parser.expr(expr)
         smap = parser.st2list(st)
         pdata = self._convert_match(smap)
-        self.dprint('PKT1', ">>> %d: match(%s)" % (self.index, expr))
+        self.dprintf('PKT1', ">>> %d: match(%s)", self.index, expr)
+
+        ckey = None
+        if self._match_cache is not None:
+            # Key of the search in the match cache
+            ckey = (pdata, self.index, minindex, maxindex, reverse, mintime, maxtime)
+            if ckey in self._match_cache:
+                index = self._match_cache.get(ckey)
+                if index is None:
+                    # Same search did not match before
+                    self.pkt = None
+                    self.dprintf('PKT1', ">>> match() -> False (cached)")
+                    return None
+                pkt = self._match_cached(pdata, index)
+                if pkt is not None:
+                    return pkt
 
-        # Search one packet at a time
+        # Packet indexes of the time window
+        tstart, tend = self._time_index(mintime, maxtime)
+        idxlist = None
+        if not reverse:
+            start = max(tstart or 0, minindex or 0)
+            if start > self.index:
+                # Skip all packets before the time window or minindex
+                try:
+                    self._seek_index(start)
+                except StopIteration:
+                    # There are no packets to search
+                    idxlist = []
+            if tend is not None:
+                maxindex = min(maxindex or tend, tend)
+
+        if idxlist is None and self.frame is not None and self.state and not self.live and not reverse:
+            # Get the list of candidate packets from the packet frame
+            idxlist = frame_match(self.frame, expr, self.index, maxindex)
+
+        if reverse:
+            # Search backwards
+            pkt = self._match_reverse(pdata, expr, max(minindex or 0, tstart or 0), tend)
+            if pkt is not None:
+                self.dprintf('PKT1', ">>> %d: match() -> True", pkt.record.index)
+                if ckey is not None:
+                    self._match_cache.add(ckey, pkt.record.index)
+                return pkt
+        elif idxlist is not None:
+            # Decode and verify only the candidate packets
+            self.dprintf('PKT1', ">>> match() -> %d candidates", len(idxlist))
+            for index in idxlist:
+                try:
+                    pkt = self[index]
+                except IndexError:
+                    break
+                if maxtime is not None and pkt.record.secs > maxtime:
+                    # Hit maxtime limit
+                    break
+                if mintime is not None and pkt.record.secs < mintime:
+                    continue
+                try:
+                    if eval(pdata):
+                        # Return matched packet
+                        self.dprintf('PKT1', ">>> %d: match() -> True", pkt.record.index)
+                        if ckey is not None:
+                            self._match_cache.add(ckey, pkt.record.index)
+                        return pkt
+                except Exception:
+                    pass
+        else:
+            # Function to check if a chunk of packets could have a match
+            sfilter = summary_filter(expr) if self._summaries else None
+            cindex = None
+            # Search one packet at a time
+            while True:
+                if sfilter is not None and self.index / _chunk_interval != cindex:
+                    # Skip all chunks which cannot have a matching packet
+                    self._skip_chunks(sfilter)
+                    cindex = self.index / _chunk_interval
+                try:
+                    pkt = self.next()
+                except StopIteration:
+                    break
+                if maxindex and self.index > maxindex:
+                    # Hit maxindex limit
+                    break
+                if maxtime is not None and pkt.record.secs > maxtime:
+                    # Hit maxtime limit
+                    break
+                if mintime is not None and pkt.record.secs < mintime:
+                    continue
+                try:
+                    if eval(pdata):
+                        # Return matched packet
+                        self.dprintf('PKT1', ">>> %d: match() -> True", pkt.record.index)
+                        if ckey is not None:
+                            self._match_cache.add(ckey, pkt.record.index)
+                        return pkt
+                except Exception:
+                    pass
+
+        # No packet matched, re-position the file pointer back to where
+        # the search started
+        self.rewind(save_index)
+        self.pkt = None
+        if ckey is not None:
+            self._match_cache.add(ckey, None)
+        self.dprintf('PKT1', ">>> match() -> False")
+        return None
+
+    def _match_cached(self, pdata, index):
+        """Return the packet given by the index of a cached match result,
+           also the packet index points to the next packet after the matched
+           packet. Returns None if the packet does not match the expression,
+           the packet index is not changed in this case.
+
+           pdata:
+               Parsed match expression as returned by _convert_match()
+           index:
+               Index of the matched packet
+        """
+        save_index = self.index
+        pkt = self[index]
+        if self.index != index + 1:
+            # The packet was already the current packet, the file pointer
+            # is re-positioned on the next call to next()
+            if self._reposition is None:
+                self._reposition = self.index
+            self.index = index + 1
+        try:
+            # The expression is evaluated again so the packet has the same
+            # attributes set by the match functions as in the first search
+            if eval(pdata):
+                self.dprintf('PKT1', ">>> %d: match() -> True (cached)", index)
+                return pkt
+        except Exception:
+            pass
+        self.rewind(save_index)
+        self.pkt = None
+        return None
+
+    def findall(self, expr, start=None, end=None, mintime=None, maxtime=None):
+        """Return a generator of all packets that match the given expression,
+           the expression is parsed just once and each packet is given as
+           soon as it matches, also the packet index points to the next
+           packet after the matched packet. Unlike match(), the trace file is
+           not rewound once there are no more matching packets, the packet
+           index is left at the end of the search.
+
+           expr:
+               String of expressions to be evaluated, see match()
+           start:
+               Search packets starting at this index [default: None, start
+               at the current packet]
+           end:
+               Search packets having an index less than this index
+               [default: None, search until the end of the trace file]
+           mintime:
+               Search only packets at or after this time in seconds relative
+               to the first packet [default: None]
+           maxtime:
+               Search only packets at or before this time in seconds relative
+               to the first packet [default: None]
+
+           The search continues from the current packet each time, so
+           the packet index can be changed in between matching packets,
+           e.g., to search for the reply of each matching call.
+
+           Examples:
+               # Same as "while x.match('NFS.argop == 38'):" without having
+               # to parse the expression each time
+               for pkt in x.findall("NFS.argop == 38"):
+                   print pkt.nfs
+        """
+        if start is not None:
+            self._seek_index(start)
+
+        # Packet indexes of the time window
+        tstart, tend = self._time_index(mintime, maxtime)
+        if tstart is not None and tstart > self.index:
+            # Skip all packets before the time window
+            self._seek_index(tstart)
+        if tend is not None:
+            end = min(end, tend) if end is not None else tend
+        if end is not None and self.index >= end:
+            return
+
+        # Parse match expression
+        pdata = self._convert_match(parser.st2list(parser.expr(expr)))
+        self.dprintf('PKT1', ">>> %d: findall(%s)", self.index, expr)
+
+        idxlist = None
+        if self.frame is not None and self.state and not self.live:
+            # Get the list of candidate packets from the packet frame
+            idxlist = frame_match(self.frame, expr, self.index, end)
+
+        if idxlist is not None:
+            # Decode and verify only the candidate packets
+            for index in idxlist:
+                if index < self.index:
+                    # Packet index has been moved ahead of this candidate
+                    continue
+                try:
+                    pkt = self[index]
+                except IndexError:
+                    return
+                if mintime is not None and pkt.record.secs < mintime:
+                    continue
+                try:
+                    if eval(pdata):
+                        yield pkt
+                except Exception:
+                    pass
+            # Move to the end of the search, the packet frame has a row
+            # for every packet in the trace file
+            eindex = len(self.frame) if end is None else min(end, len(self.frame))
+            if self.index < eindex:
+                self._seek_index(eindex)
+        else:
+            # Function to check if a chunk of packets could have a match
+            sfilter = summary_filter(expr) if self._summaries else None
+            cindex = None
+            while end is None or self.index < end:
+                if sfilter is not None and self.index / _chunk_interval != cindex:
+                    # Skip all chunks which cannot have a matching packet
+                    self._skip_chunks(sfilter)
+                    cindex = self.index / _chunk_interval
+                    if end is not None and self.index > end:
+                        # Skipped past the end of the search
+                        self._seek_index(end)
+                        break
+                try:
+                    pkt = self.next()
+                except StopIteration:
+                    break
+                if maxtime is not None and pkt.record.secs > maxtime:
+                    break
+                if mintime is not None and pkt.record.secs < mintime:
+                    continue
+                try:
+                    if eval(pdata):
+                        yield pkt
+                except Exception:
+                    pass
+        self.dprintf('PKT1', ">>> findall() -> done at %d", self.index)
+
+    def to_frame(self, fields=None):
+        """Return a NumPy structured array having a row for each packet in
+           the trace file and a column for each of the given fields. The row
+           number is the packet index. The whole trace file is processed in
+           a single pass and the frame is also stored in the object attribute
+           frame. The current position in the trace file is not changed.
+
+           fields:
+               List of field names, all fields are used if this is None.
+               See the packet.frame module for the list of valid fields.
+
+           Examples:
+               # Get the index, timestamp and main operation of all packets
+               frame = x.to_frame(['index', 'ts', 'op'])
+
+               # Histogram of all READ sizes
+               frame = x.to_frame()
+               reads = frame[(frame['type'] == 1) & (frame['op'] == 25)]
+               hist = numpy.bincount(reads['count'] >> 12)
+        """
+        self.dprintf('PKT1', ">>> to_frame(%s)", fields)
+        # Make sure the trace file has been opened
+        self._getfh()
+        save_index = self.index
+        self.rewind(0)
+        try:
+            self.frame = pkt_frame(self, fields)
+        finally:
+            self.rewind(save_index)
+        self._register()
+        return self.frame
+
+    def match_index(self, expr, index):
+        """Return the packet given by index if it matches the given expression,
+           also the packet index points to the next packet after the matched
+           packet. Returns None if the packet does not match and the packet
+           index points to the given index.
+
+           expr:
+               String of expressions to be evaluated
+           index:
+               Packet index to match
+
+           Examples:
+               # Verify packet 125 is an NFS WRITE request
+               pkt = x.match_index("NFS.argop == 38", 125)
+        """
+        try:
+            self._seek_index(index)
+        except StopIteration:
+            return None
+        return self.match(expr, maxindex=index+1)
+
+    def write(self, outfile, expr=None, start=0, end=None, mintime=None, maxtime=None):
+        """Write the records of all packets matching the given expression to
+           a new trace file. The raw bytes of each record are copied as they
+           are in the trace file, without decoding them if possible. The
+           current position in the trace file is not changed.
+
+           outfile:
+               Name of the trace file to create
+           expr:
+               Write only the packets matching this expression, see match()
+               [default: None, write all packets]
+           start:
+               Write packets starting at this packet index [default: 0]
+           end:
+               Write packets before this packet index [default: None, write
+               packets up to the end of the trace file]
+           mintime:
+               Write only packets at or after this time in seconds relative
+               to the first packet [default: None]
+           maxtime:
+               Write only packets at or before this time in seconds relative
+               to the first packet [default: None]
+
+           Examples:
+               # Write all WRITE calls and replies of the given file handle
+               x.write("/tmp/writes.cap", "NFS.object == '%s' and NFS.op == 38" % x.escape(fh))
+
+               # Write all packets captured during the second minute
+               x.write("/tmp/slice.cap", mintime=60, maxtime=120)
+        """
+        self.dprintf('PKT1', ">>> write(%s, %s, %d, %s)", outfile, expr, start, end)
+        self._getfh()
+        save_index = self.index
+        rfh = self._rawfh()
+        out = open(outfile, 'wb')
+        try:
+            # Copy the file header
+            out.write(rfh.read(24))
+            if end is not None and end <= start:
+                return
+            if self.tstart is None:
+                # Get the timestamp of the first packet
+                try:
+                    self[0]
+                except IndexError:
+                    return
+
+            if expr is not None:
+                # Write each record having a matching packet
+                woffset = None
+                try:
+                    self._seek_index(start)
+                except StopIteration:
+                    return
+                while True:
+                    pkt = self.match(expr, maxindex=end, mintime=mintime, maxtime=maxtime)
+                    if pkt is None:
+                        break
+                    offset = self.pkt_map[pkt.record.index]
+                    if offset != woffset:
+                        # A record could have more than one packet
+                        woffset = offset
+                        rfh.seek(offset)
+                        header = rfh.read(16)
+                        out.write(header + rfh.read(struct.unpack(self.header_rec, header)[2]))
+                return
+
+            # Get the offset range of the records to write
+            if start < len(self.pkt_map):
+                soffset = self.pkt_map[start]
+            else:
+                try:
+                    self._seek_index(start)
+                except StopIteration:
+                    return
+                soffset = self.offset
+            eoffset = None
+            if end is not None:
+                try:
+                    if end > len(self.pkt_map):
+                        self._seek_index(end)
+                    # Offset of the last record to write
+                    eoffset = self.pkt_map[end-1]
+                except StopIteration:
+                    pass
+
+            rfh.seek(soffset)
+            offset = soffset
+            if mintime is None and maxtime is None:
+                # Copy all records in the range as a single block
+                if eoffset is not None:
+                    rfh.seek(eoffset)
+                    header = rfh.read(16)
+                    if len(header) < 16:
+                        eoffset = None
+                    else:
+                        eoffset += 16 + struct.unpack(self.header_rec, header)[2]
+                    rfh.seek(soffset)
+                while eoffset is None or offset < eoffset:
+                    size = _copy_size if eoffset is None else min(_copy_size, eoffset - offset)
+                    data = rfh.read(size)
+                    if not data:
+                        break
+                    out.write(data)
+                    offset += len(data)
+                return
+
+            # Copy each record within the time range
+            while eoffset is None or offset <= eoffset:
+                header = rfh.read(16)
+                if len(header) < 16:
+                    break
+                record = struct.unpack(self.header_rec, header)
+                data = rfh.read(record[2])
+                if len(data) < record[2]:
+                    break
+                offset += 16 + record[2]
+                secs = record[0] + record[1]/1000000.0 - self.tstart
+                if (mintime is None or secs >= mintime) and \
+                   (maxtime is None or secs <= maxtime):
+                    out.write(header + data)
+        finally:
+            out.close()
+            rfh.close()
+            self.rewind(save_index)
+
+    def rpc_messages(self):
+        """Return a generator of all RPC messages starting at the current
+           packet. Each RPC message spanning multiple TCP segments is given
+           once it has been reassembled and each RPC message within the same
+           TCP segment is given separately, the segment is decoded just once
+           for all its RPC messages. Non-RPC packets are skipped.
+
+           Each item is an RPCMessage object having the packet indexes where
+           the message starts and ends.
+
+           Examples:
+               # List the packet range of every RPC message
+               for msg in x.rpc_messages():
+                   print msg.first, msg.last, msg.rpc.xid
+        """
         for pkt in self:
-            if maxindex and self.index > maxindex:
-                # Hit maxindex limit
+            rpc = getattr(pkt, 'rpc', None)
+            if rpc is None:
+                continue
+            last = pkt.record.index
+            yield RPCMessage(
+                pkt   = pkt,
+                rpc   = rpc,
+                nfs   = getattr(pkt, 'nfs', None),
+                first = getattr(rpc, '_pindex', last),
+                last  = last,
+            )
+
+    def _pair_key(self, pkt, xid, reply=False):
+        """Return the key of a call in the table of calls waiting for their
+           reply, the key is given by the raw addresses and ports of the
+           call and the RPC xid so the reply, which has the addresses and
+           ports swapped, gets the same key as its call.
+
+           pkt:
+               Packet object having the RPC call or reply
+           xid:
+               RPC transaction id
+           reply:
+               The packet is a reply [default: False]
+        """
+        ip  = getattr(pkt, 'ip', None)
+        tcp = getattr(pkt, 'tcp', None)
+        src = getattr(ip, '_saddr', None)
+        dst = getattr(ip, '_daddr', None)
+        sport = getattr(tcp, 'src_port', None)
+        dport = getattr(tcp, 'dst_port', None)
+        if reply:
+            return (dst, dport, src, sport, xid)
+        return (src, sport, dst, dport, xid)
+
+    def pairs(self, filter=None, maxsize=_pairs_maxsize, maxage=None):
+        """Return a generator of all (call, reply) tuples starting at the
+           current packet. Each tuple is given as soon as the reply is found
+           so the tuples are in reply order and the trace file is processed
+           just once. The calls waiting for their reply are kept in a table
+           keyed by the connection and the RPC xid, so calls from different
+           clients or connections reusing the same xid are not mixed up, a
+           retransmitted call on the same connection replaces the call in
+           the table.
+
+           filter:
+               String of expressions to be evaluated on each call, see
+               match() [default: None, all calls]
+           maxsize:
+               Maximum number of calls waiting for their reply, the oldest
+               call is dropped from the table when this limit is reached
+               [default: 65536]
+           maxage:
+               Maximum number of seconds a call waits for its reply, older
+               calls are dropped from the table [default: None, no limit]
+
+           All calls which are dropped from the table or which are still
+           waiting for their reply at the end of the trace file are stored
+           in the object attribute unmatched. All calls replaced in the
+           table by a retransmitted call are stored in the object attribute
+           retransmitted.
+
+           Examples:
+               # Get the status of every WRITE
+               for call, reply in x.pairs("NFS.argop == 38"):
+                   print call.rpc.xid, reply.nfs.status
+               print "WRITE calls without a reply: %d" % len(x.unmatched)
+        """
+        pdata = None
+        if filter is not None:
+            pdata = self._convert_match(parser.st2list(parser.expr(filter)))
+        self.dprintf('PKT1', ">>> %d: pairs(%s)", self.index, filter)
+
+        pending = OrderedDict()
+        self.unmatched = []
+        self.retransmitted = []
+        for pkt in self:
+            rpc = getattr(pkt, 'rpc', None)
+            if rpc is None:
+                continue
+            if maxage is not None:
+                # Drop all calls which have been waiting for too long
+                while pending:
+                    call = pending.itervalues().next()
+                    if pkt.record.secs - call.record.secs <= maxage:
+                        break
+                    self.unmatched.append(pending.popitem(last=False)[1])
+            if rpc.type == CALL:
+                if pdata is not None:
+                    try:
+                        if not eval(pdata):
+                            continue
+                    except Exception:
+                        continue
+                key = self._pair_key(pkt, rpc.xid)
+                call = pending.get(key)
+                if call is not None:
+                    self.retransmitted.append(call)
+                pending[key] = pkt
+                if len(pending) > maxsize:
+                    self.unmatched.append(pending.popitem(last=False)[1])
+            else:
+                call = pending.pop(self._pair_key(pkt, rpc.xid, reply=True), None)
+                if call is not None:
+                    yield (call, pkt)
+
+        self.unmatched.extend(pending.itervalues())
+        self.dprintf('PKT1', ">>> pairs() -> %d unmatched calls", len(self.unmatched))
+
+    def sample(self, rate, unit='stream', window=1.0, seed=0):
+        """Return an iterator over the packets of a random sample of the
+           TCP/UDP connections or time windows in the trace file, only the
+           records in the sample are decoded. The current position in the
+           trace file is not changed.
+
+           rate:
+               Probability of selecting each sampling unit (0.0 - 1.0)
+           unit:
+               Sampling unit: 'stream' or 'time' [default: 'stream']
+           window:
+               Number of seconds in each time window for the time unit
+               [default: 1.0]
+           seed:
+               Seed for selecting the sampling units [default: 0]
+
+           Examples:
+               # Estimated number of WRITE calls using 5% of all connections
+               total, error = x.sample(0.05).count("NFS.argop == 38")
+
+           See packet.sample module for more information
+        """
+        return PktSample(self, rate, unit=unit, window=window, seed=seed)
+
+    def stats(self):
+        """Return a dictionary of the statistics collected while decoding
+           the packets. It has the capture health counters as 'counters',
+           for all packets processed so far, so a capture losing packets
+           can be told apart from an actual test failure:
+               truncated       = Number of records captured partially
+               retransmissions = Number of TCP retransmissions skipped
+               resyncs         = Number of times an RPC record spanning
+                                 multiple TCP segments is dropped to re-sync
+                                 the TCP stream, e.g., a segment is missing
+               nfs_errors      = Number of NFS calls and replies which
+                                 could not be decoded
+               noreply         = Number of RPC calls without a reply
+               ethernet_bytes, ip_bytes, tcp_bytes, rpc_bytes, nfs_bytes =
+                                 Number of bytes decoded for each layer
+
+           When the object is created with the timing option, it also has
+           the count and time of each layer decoded as 'layers' and of each
+           NFS operation decoded as 'nfsops', see packet.profiler.LayerTimer.
+
+           Examples:
+               x = Pktt("/traces/tracefile.cap", timing=True)
+               for pkt in x:
+                   pass
+               # Display the layers taking most of the decoding time
+               layers = x.stats()['layers']
+               for name in sorted(layers, key=lambda k: -layers[k]['time']):
+                   print name, layers[name]['count'], layers[name]['time']
+
+               # Warn if packets were lost by the capture
+               counters = x.stats()['counters']
+               if counters['resyncs'] or counters['truncated']:
+                   print "Capture is missing data"
+        """
+        counters = dict(self.counters)
+        counters['noreply'] = sum(1 for item in self._rpc_xid_map.itervalues()
+                                  if 'call_index' in item and 'reply_index' not in item)
+        stats = {'counters': counters}
+        if self.timing is not None:
+            stats.update(self.timing.stats())
+        return stats
+
+    def ready(self):
+        """Return True if the next packet can be fetched without waiting for
+           more data to be written to the trace file. This is always True
+           unless the object was created with the live option.
+
+           NOTE:
+               A compressed live trace file is not supported, there is no
+               way to tell how much data is available so it is never ready
+        """
+        if not self.live or self._reposition is not None or self._tcp_cont is not None:
+            return True
+        if self.fh is None:
+            # Wait for tcpdump to write the file header
+            if not os.path.isfile(self.tfile) or os.path.getsize(self.tfile) < 24:
+                return False
+        fh = self._getfh()
+        if isinstance(fh, gzip.GzipFile):
+            # Cannot tell how much data is available, fetching the packet
+            # could block
+            return False
+        size = os.fstat(fh.fileno()).st_size
+        if size >= self.offset + 16:
+            header = fh.read(16)
+            fh.seek(self.offset)
+            length = struct.unpack(self.header_rec, header)[2]
+            return size >= self.offset + 16 + length
+        # There is no more data in this file, but tcpdump could have
+        # moved on to the next trace file, the packet is ready only when
+        # the next trace file has its file header and the whole first
+        # record, the next trace file has the same byte order
+        tracefile = "%s%d" % (self.bfile, self.findex+1)
+        try:
+            with open(tracefile, 'rb') as fd:
+                header = fd.read(40)
+                size = os.fstat(fd.fileno()).st_size
+        except IOError:
+            return False
+        if len(header) < 40:
+            return False
+        length = struct.unpack(self.header_rec, header[24:])[2]
+        return size >= 40 + length
+
+    def _wait_ready(self, interval, etime=None):
+        """Wait until the next packet can be fetched without waiting for
+           more data, return True if the packet is ready.
+
+           interval:
+               Maximum number of seconds to wait
+           etime:
+               Do not wait past this time [default: None]
+        """
+        if interval <= 0:
+            return False
+        etime = time.time() + interval if etime is None else min(etime, time.time() + interval)
+        while True:
+            delay = etime - time.time()
+            if delay <= 0:
+                return False
+            time.sleep(min(delay, _ready_poll))
+            if self.ready():
+                return True
+
+    def aiter(self, timeout=None, interval=0):
+        """Return a generator of all packets starting at the current packet
+           which does not block waiting for more data to be written to a live
+           trace file for more than the given interval, it yields None instead
+           so the caller can do some other work before asking for the next
+           packet. The generator stops at the end of a non-live trace file or
+           when no packet has been available for the given number of seconds.
+
+           timeout:
+               Number of seconds to wait for the next packet [default: None,
+               wait forever]
+           interval:
+               Maximum number of seconds to wait for more data before
+               yielding None, by default None is yielded right away when
+               no packet is ready so the caller decides what to do while
+               waiting, a caller having nothing else to do should either
+               sleep or give an interval [default: 0]
+
+           Examples:
+               # Process live packets while running the workload in steps
+               for pkt in x.aiter(timeout=60):
+                   if pkt is None:
+                       workload.step()
+                   else:
+                       print pkt
+
+               # Just wait for the packets, checking for more data
+               # every 0.1 seconds
+               for pkt in x.aiter(timeout=60, interval=0.1):
+                   if pkt is not None:
+                       print pkt
+        """
+        etime = None if timeout is None else time.time() + timeout
+        while True:
+            if self.ready():
+                try:
+                    yield self.next()
+                except StopIteration:
+                    return
+                etime = None if timeout is None else time.time() + timeout
+            elif etime is not None and time.time() >= etime:
+                return
+            elif not self._wait_ready(interval, etime):
+                yield None
+
+    def amatch(self, expr, timeout=None, interval=0):
+        """Return a generator which yields None while waiting for more data
+           to be written to a live trace file and yields the packet matching
+           the given expression as its last item. If no packet matches before
+           the timeout expires or before the end of a non-live trace file,
+           the generator stops without yielding a packet and the packet index
+           points to the packet at the beginning of the search.
+
+           expr:
+               String of expressions to be evaluated, see match()
+           timeout:
+               Number of seconds to wait for the matching packet [default:
+               None, wait forever]
+           interval:
+               Maximum number of seconds to wait for more data before
+               yielding None, by default None is yielded right away when
+               no packet is ready so the caller decides what to do while
+               waiting, a caller having nothing else to do should either
+               sleep or give an interval [default: 0]
+
+           Examples:
+               # Wait for the WRITE request while running the workload
+               for pkt in x.amatch("NFS.argop == 38", timeout=60):
+                   if pkt is None:
+                       workload.step()
+                   else:
+                       print pkt.nfs
+        """
+        # Save current position
+        save_index = self.index
+
+        # Parse match expression
+        pdata = self._convert_match(parser.st2list(parser.expr(expr)))
+        self.dprintf('PKT1', ">>> %d: amatch(%s)", self.index, expr)
+
+        etime = None if timeout is None else time.time() + timeout
+        while True:
+            if self.ready():
+                try:
+                    pkt = self.next()
+                except StopIteration:
+                    break
+                try:
+                    if eval(pdata):
+                        # Return matched packet
+                        self.dprintf('PKT1', ">>> %d: amatch() -> True", pkt.record.index)
+                        yield pkt
+                        return
+                except Exception:
+                    pass
+            elif etime is not None and time.time() >= etime:
                 break
-            try:
-                if eval(pdata):
-                    # Return matched packet
-                    self.dprint('PKT1', ">>> %d: match() -> True" % pkt.record.index)
-                    return pkt
-            except Exception:
-                pass
+            elif not self._wait_ready(interval, etime):
+                yield None
 
         # No packet matched, re-position the file pointer back to where
         # the search started
         self.rewind(save_index)
         self.pkt = None
-        self.dprint('PKT1', ">>> match() -> False")
-        return None
+        self.dprintf('PKT1', ">>> amatch() -> False")
+
+    def open_db(self, dbfile=None):
+        """Open the trace database for this trace file, the database is
+           created if it does not exist or if the trace file has been modified
+           since it was created. The trace database is also stored in the
+           object attribute tracedb, it is not shared with other packet trace
+           objects opening the same trace file. The current position in the
+           trace file is not changed.
+
+           dbfile:
+               Name of the database file [default: '<tracefile>.db']
+
+           Examples:
+               # Find all WRITE calls using the trace database
+               tracedb = x.open_db()
+               for row in tracedb.find(op=38):
+                   pkt = x[row['call_index']]
+
+           See packet.tracedb module for more information
+        """
+        if dbfile is None:
+            dbfile = self.tfile + '.db'
+        self.dprintf('PKT1', ">>> open_db(%s)", dbfile)
+        # Make sure the trace file has been opened
+        self._getfh()
+        tracedb = TraceDB(dbfile)
+        if not tracedb.isvalid(self.tfile):
+            self.dprintf('PKT1', ">>> open_db() -> creating trace database")
+            save_index = self.index
+            self.rewind(0)
+            try:
+                tracedb.export(self)
+            finally:
+                self.rewind(save_index)
+        self.tracedb = tracedb
+        return tracedb
 
     @staticmethod
     def escape(data):
@@ -0,0 +1,192 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Record prefetch module
+
+Provides a reader thread which reads the records of a packet trace file
+ahead of the packet trace object. The thread has its own file handle, it
+reads and decompresses (for a gzip trace file) the records starting at a
+given file offset and puts them in a bounded queue. This way the I/O wait
+and decompression of the trace file overlap with the decoding of the
+packets and with any other processing done by the caller.
+
+Each record in the queue is identified by its file offset so the reader is
+restarted whenever the records are requested from a different offset, e.g.,
+after the packet trace is rewound.
+"""
+import gzip
+import atexit
+import struct
+import weakref
+import threading
+import nfstest_config as c
+from Queue import Queue, Full
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Default number of records in the queue
+_PREFETCH_depth = 1024
+# Number of seconds to wait for space in the queue before checking if the
+# reader thread has been stopped
+_PREFETCH_timeout = 0.1
+# Identifiers of a tcpdump file: little and big endian
+_PREFETCH_idents = ('\324\303\262\241', '\241\262\303\324')
+# All prefetch objects having a running reader thread
+_PREFETCH_running = weakref.WeakSet()
+
+def _stop_all():
+    """Stop all reader threads before the interpreter shuts down"""
+    for prefetch in list(_PREFETCH_running):
+        prefetch.stop()
+atexit.register(_stop_all)
+
+class Prefetch(object):
+    """Record prefetch object
+
+       Usage:
+           from packet.prefetch import Prefetch
+
+           x = Prefetch("/traces/tracefile.cap", '<IIII')
+
+           # Get the record header and data at the given file offset,
+           # raise StopIteration at the end of the trace file
+           header, data = x.get(offset)
+
+           # Stop the reader thread
+           x.stop()
+    """
+    def __init__(self, tfile, header_rec, depth=_PREFETCH_depth):
+        """Constructor
+
+           Initialize object's private data, the reader thread is started
+           the first time a record is requested.
+
+           tfile:
+               Name of tcpdump trace file
+           header_rec:
+               Format of the record header as given to struct.unpack()
+           depth:
+               Maximum number of records in the queue
+        """
+        self.tfile      = tfile
+        self.header_rec = header_rec
+        self.depth      = depth
+        self.offset     = None  # File offset of the next record in the queue
+        self.eof        = None  # File offset of the end of the trace file
+        self._thread    = None
+        self._queue     = None
+        self._stop      = None
+
+    def __del__(self):
+        """Destructor
+
+           Stop the reader thread.
+        """
+        self.stop()
+
+    def _open(self):
+        """Open the trace file, return a gzip file object if the trace file
+           is compressed.
+        """
+        fh = open(self.tfile, 'rb')
+        if fh.read(4) not in _PREFETCH_idents:
+            fh.seek(0)
+            fh = gzip.GzipFile(fileobj=fh)
+        return fh
+
+    def _put(self, queue, stop, item):
+        """Put item in the queue, return False if the thread is stopped"""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=_PREFETCH_timeout)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _reader(self, offset, queue, stop):
+        """Reader thread: put all records starting at the given offset in
+           the queue, the end of the trace file is given by None and any
+           errors are given by the exception object.
+        """
+        fh = None
+        try:
+            fh = self._open()
+            fh.seek(offset)
+            while True:
+                item = None
+                header = fh.read(16)
+                if len(header) == 16:
+                    length = struct.unpack(self.header_rec, header)[2]
+                    data = fh.read(length)
+                    if len(data) == length:
+                        item = (offset, header, data)
+                        offset += 16 + length
+                if not self._put(queue, stop, item) or item is None:
+                    break
+        except Exception as error:
+            self._put(queue, stop, error)
+        finally:
+            if fh:
+                fh.close()
+
+    def start(self, offset):
+        """Start the reader thread at the given file offset, the thread is
+           stopped first if it is running.
+        """
+        self.stop()
+        self.offset  = offset
+        self._queue  = Queue(self.depth)
+        self._stop   = threading.Event()
+        self._thread = threading.Thread(target=self._reader, args=(offset, self._queue, self._stop))
+        self._thread.daemon = True
+        self._thread.start()
+        _PREFETCH_running.add(self)
+
+    def stop(self):
+        """Stop the reader thread and discard all records in the queue"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._queue  = None
+            self.offset  = None
+            _PREFETCH_running.discard(self)
+
+    def get(self, offset):
+        """Return the tuple (header, data) of the record at the given file
+           offset, raise StopIteration at the end of the trace file.
+
+           offset:
+               File offset of the record
+        """
+        if offset == self.eof:
+            raise StopIteration
+        if self._thread is None or offset != self.offset:
+            # Records are requested from a different offset
+            self.start(offset)
+
+        item = self._queue.get()
+        if item is None or isinstance(item, Exception):
+            self.stop()
+            if item is None:
+                self.eof = offset
+                raise StopIteration
+            raise item
+        self.offset = offset + len(item[1]) + len(item[2])
+        return item[1:]
@@ -0,0 +1,263 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Match profiler module
+
+Provides a profiler for the match() and rewind() calls of packet trace
+objects to find out which searches are expensive. Each call is recorded
+with the following information:
+    call    = Name of the method called: 'match' or 'rewind'
+    expr    = Match expression or packet index given to the method
+    caller  = Source file, line number and function name of the caller
+    read    = Number of packets read, including packet cache hits
+    decoded = Number of packets decoded from the trace file
+    rewinds = Number of rewinds triggered by the call
+    time    = Wall time in seconds
+
+Calls made while another call is being profiled, e.g., the rewind() calls
+done by match(), are not recorded by themselves, they are accounted for in
+the outermost call instead. The report of all calls is sorted by wall time
+so the most expensive searches are listed first.
+
+Also provides a timer for the decoding of each packet layer, see LayerTimer.
+"""
+import os
+import sys
+import json
+import time
+import functools
+import nfstest_config as c
+from timeit import default_timer
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+def profiled(func):
+    """Decorator for a packet trace method so each call is recorded by the
+       profiler of the packet trace object, if any. The first argument of
+       the method is recorded as the expression and the caller is the first
+       function outside the module of the method.
+    """
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(pktt, *args, **kwargs):
+        profiler = pktt.profiler
+        if profiler is None:
+            return func(pktt, *args, **kwargs)
+        profiler.start()
+        try:
+            return func(pktt, *args, **kwargs)
+        finally:
+            expr = args[0] if args else kwargs.get('expr', kwargs.get('index', 0))
+            frame = sys._getframe(1)
+            while frame.f_back is not None and frame.f_globals.get('__name__') == func.__module__:
+                frame = frame.f_back
+            profiler.stop(name, expr, frame)
+    return wrapper
+
+class MatchProfiler(object):
+    """Match profiler object
+
+       Usage:
+           from packet.pktt import Pktt
+           from packet.profiler import MatchProfiler
+
+           prof = MatchProfiler()
+           x = Pktt("/traces/tracefile.cap", profiler=prof)
+
+           pkt = x.match("NFS.argop == 50")
+           x.rewind()
+           pkt = x.match("NFS.argop == 50")
+
+           # Display the calls sorted by wall time
+           print prof.report()
+
+           # Save all calls as JSON
+           prof.dump("/tmp/profile.json")
+    """
+    def __init__(self):
+        """Constructor
+
+           Initialize object's private data.
+        """
+        self.calls   = []  # List of recorded calls
+        self.decoded = 0   # Number of packets decoded so far
+        self.cached  = 0   # Number of packet cache hits so far
+        self.rewinds = 0   # Number of rewinds so far
+        self._depth  = 0   # Number of calls in progress
+        self._start  = None
+
+    def start(self):
+        """Start profiling a call"""
+        self._depth += 1
+        if self._depth == 1:
+            self._start = (time.time(), self.decoded, self.cached, self.rewinds)
+
+    def stop(self, call, expr, frame):
+        """Stop profiling a call, the call is recorded if it is the
+           outermost call.
+
+           call:
+               Name of the method called
+           expr:
+               Match expression or packet index given to the method
+           frame:
+               Stack frame of the caller
+        """
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        stime, decoded, cached, rewinds = self._start
+        code = frame.f_code
+        decoded = self.decoded - decoded
+        self.calls.append({
+            'call':    call,
+            'expr':    str(expr),
+            'caller':  "%s:%d(%s)" % (os.path.basename(code.co_filename), frame.f_lineno, code.co_name),
+            'read':    decoded + self.cached - cached,
+            'decoded': decoded,
+            'rewinds': self.rewinds - rewinds,
+            'time':    time.time() - stime,
+        })
+
+    def summary(self):
+        """Return the list of all calls grouped by method, expression and
+           caller, sorted by total wall time in descending order. Each item
+           has the same attributes as a recorded call with the totals for
+           the group and the number of calls in the group as 'count'.
+        """
+        groups = {}
+        for item in self.calls:
+            key = (item['call'], item['expr'], item['caller'])
+            group = groups.get(key)
+            if group is None:
+                group = dict(item, count=0, read=0, decoded=0, rewinds=0, time=0.0)
+                groups[key] = group
+            group['count'] += 1
+            for name in ('read', 'decoded', 'rewinds', 'time'):
+                group[name] += item[name]
+        return sorted(groups.values(), key=lambda x: x['time'], reverse=True)
+
+    def report(self, count=None):
+        """Return the report of all calls grouped by method, expression and
+           caller as a string, sorted by total wall time in descending order.
+
+           count:
+               Maximum number of groups in the report [default: None, all
+               groups are included]
+        """
+        lines = ["%-10s %6s %10s %10s %8s  %-30s %s" % ("TIME", "CALLS", "READ", "DECODED", "REWINDS", "CALLER", "EXPRESSION")]
+        for item in self.summary()[:count]:
+            lines.append("%10.6f %6d %10d %10d %8d  %-30s %s(%s)" % (
+                item['time'], item['count'], item['read'], item['decoded'],
+                item['rewinds'], item['caller'], item['call'], item['expr']))
+        return "\n".join(lines)
+
+    def dump(self, filename):
+        """Save all recorded calls and the grouped calls as JSON to the
+           given file.
+
+           filename:
+               Name of the JSON file
+        """
+        with open(filename, 'w') as fd:
+            json.dump({'calls': self.calls, 'summary': self.summary()}, fd, indent=1)
+
+class LayerTimer(object):
+    """Layer timer object
+
+       Usage:
+           from packet.pktt import Pktt
+
+           x = Pktt("/traces/tracefile.cap", timing=True)
+           for pkt in x:
+               pass
+
+           # Number of ETHERNET layers decoded and the time spent
+           # decoding them
+           stats = x.stats()
+           print stats['layers']['ETHERNET']
+
+       Each layer is timed from the start to the end of its constructor,
+       the time of a layer excludes the time of the upper layers decoded
+       by it, e.g., the time of the TCP layer does not include the time
+       spent decoding its RPC payload. The NFS decoding time is also given
+       for each NFS operation, the time of each operation is part of the
+       time of the NFS layer.
+
+       Python 2 has no monotonic clock, the most precise wall clock for the
+       platform is used instead.
+    """
+    def __init__(self):
+        """Constructor
+
+           Initialize object's private data.
+        """
+        self.clock  = default_timer
+        self.layers = {}   # Count and time for each layer
+        self.nfsops = {}   # Count and time for each NFS operation
+        self._child = 0.0  # Time of the upper layers of the current layer
+
+    def start(self):
+        """Start timing a layer, return the token to give to stop()"""
+        token = (self.clock(), self._child)
+        self._child = 0.0
+        return token
+
+    def stop(self, name, token):
+        """Stop timing a layer.
+
+           name:
+               Name of the layer
+           token:
+               Token returned by start()
+        """
+        stime, child = token
+        elapsed = self.clock() - stime
+        item = self.layers.get(name)
+        if item is None:
+            item = [0, 0.0]
+            self.layers[name] = item
+        item[0] += 1
+        item[1] += elapsed - self._child
+        self._child = child + elapsed
+
+    def add_op(self, name, elapsed):
+        """Add the time spent decoding an NFS operation.
+
+           name:
+               Name of the NFS operation
+           elapsed:
+               Time in seconds
+        """
+        item = self.nfsops.get(name)
+        if item is None:
+            item = [0, 0.0]
+            self.nfsops[name] = item
+        item[0] += 1
+        item[1] += elapsed
+
+    def stats(self):
+        """Return a dictionary having the count and time of each layer as
+           'layers' and of each NFS operation as 'nfsops', e.g.:
+               {'layers': {'TCP': {'count': 120, 'time': 0.0021}, ...},
+                'nfsops': {'OP_WRITE': {'count': 30, 'time': 0.0032}, ...}}
+        """
+        ret = {}
+        for attr in ('layers', 'nfsops'):
+            ret[attr] = dict((name, {'count': item[0], 'time': item[1]}) for name, item in getattr(self, attr).items())
+        return ret
@@ -0,0 +1,302 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Packet sample module
+
+Provides a sampling iterator over a packet trace file for approximate
+analysis of very large trace files. The trace file is divided into sampling
+units and each unit is selected with the given probability (rate), only the
+records belonging to the selected units are decoded, all other records are
+skipped by just reading their record header.
+
+Sampling units:
+    stream = All packets of the same TCP or UDP connection, both directions
+             of the connection are in the same unit so a selected unit has
+             all its packets and the TCP reassembly is still valid
+    time   = All packets within the same time window, the TCP reassembly of
+             the first packets in each window could be incomplete
+
+A unit is selected using a hash of the unit so the same units are selected
+every time for the same seed. Any total computed from the sampled packets
+is estimated using the Horvitz-Thompson estimator, see estimate().
+"""
+import math
+import zlib
+import struct
+import parser
+from StringIO import StringIO
+import nfstest_config as c
+from baseobj import BaseObj
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Valid sampling units
+SAMPLE_UNITS = ('stream', 'time')
+# Transport protocols having ports: TCP and UDP
+_SAMPLE_ports = (6, 17)
+# Number of bytes of each record needed to get the stream key
+_SAMPLE_keylen = 64
+
+def estimate(values, rate, zvalue=1.96):
+    """Return the tuple (total, error) where total is the estimated total
+       over all sampling units and error is the half width of its confidence
+       interval, so the actual total is within total +/- error with the
+       confidence given by zvalue.
+
+       values:
+           List of the values of all selected units, e.g., the number of
+           matching packets in each selected stream
+       rate:
+           Probability of selecting each unit
+       zvalue:
+           Number of standard deviations for the confidence interval
+           [default: 1.96, 95% confidence]
+    """
+    total = sum(values) / float(rate)
+    variance = (1.0 - rate) / (rate * rate) * sum(v * v for v in values)
+    return (total, zvalue * math.sqrt(variance))
+
+def _stream_key(data):
+    """Return the unit key of an ethernet frame for the stream unit, both
+       directions of the same connection have the same key. Return None if
+       the frame is not a TCP or UDP packet.
+    """
+    if len(data) < 14:
+        return None
+    etype = struct.unpack('!H', data[12:14])[0]
+    if etype == 0x0800:
+        # IPv4
+        if len(data) < 34:
+            return None
+        ihl = (ord(data[14]) & 0x0F) * 4
+        proto = ord(data[23])
+        src = data[26:30]
+        dst = data[30:34]
+        offset = 14 + ihl
+    elif etype == 0x86dd:
+        # IPv6, extension headers are not supported
+        if len(data) < 54:
+            return None
+        proto = ord(data[20])
+        src = data[22:38]
+        dst = data[38:54]
+        offset = 54
+    else:
+        return None
+    if proto not in _SAMPLE_ports or len(data) < offset + 4:
+        return None
+    src += data[offset:offset+2]
+    dst += data[offset+2:offset+4]
+    if src > dst:
+        src, dst = dst, src
+    return chr(proto) + src + dst
+
+class PktSample(BaseObj):
+    """Packet sample object
+
+       Usage:
+           from packet.pktt import Pktt
+           from packet.sample import PktSample, estimate
+
+           x = Pktt("/traces/tracefile.cap")
+
+           # Decode only 10% of all TCP connections
+           values = {}
+           for pkt in PktSample(x, 0.1):
+               if pkt == 'nfs':
+                   values[pkt.unit] = values.get(pkt.unit, 0) + 1
+           total, error = estimate(values.values(), 0.1)
+
+       Each packet returned has the following attribute:
+           unit = Key of the sampling unit of the packet
+
+       The record index of each packet is the index of the record in the
+       trace file, which is the packet index unless a previous record had
+       more than one RPC packet.
+    """
+    def __init__(self, pktt, rate, unit='stream', window=1.0, seed=0):
+        """Constructor
+
+           Initialize object's private data. The trace file is processed
+           from the beginning using its own file handle so the packet trace
+           object given is not changed.
+
+           pktt:
+               Packet trace object (packet.pktt.Pktt)
+           rate:
+               Probability of selecting each sampling unit (0.0 - 1.0)
+           unit:
+               Sampling unit: 'stream' or 'time' [default: 'stream']
+           window:
+               Number of seconds in each time window for the time unit
+               [default: 1.0]
+           seed:
+               Seed for selecting the sampling units [default: 0]
+        """
+        if unit not in SAMPLE_UNITS:
+            raise Exception("Unknown sampling unit: %s" % unit)
+        if rate <= 0.0 or rate > 1.0:
+            raise Exception("Invalid sampling rate: %s" % rate)
+        self.rate   = rate
+        self.unit   = unit
+        self.window = window
+        self.seed   = seed
+        self.rindex = 0     # Current record index
+        self.pkt    = None  # Current packet
+        self.nrecords = 0   # Number of records processed
+        self.nsampled = 0   # Number of records decoded
+
+        pktt._getfh()
+        self._fh = pktt._rawfh()
+        self._fh.seek(24)
+        self._header_rec = pktt.header_rec
+        self._link_type  = pktt.header.link_type
+        self._threshold  = int(rate * 0x100000000)
+        self._tstart     = None
+        self._selected   = {}  # Cache of the selected state of each unit
+        self._pkts       = []  # Packets decoded from the current record
+
+        # Packet trace object used to decode the selected records, it does
+        # not keep any state other than the TCP streams. The trace file is
+        # not opened by it, the file header is taken from the given object
+        # and each record is given to it in memory, see _decode()
+        self._pktt = pktt.__class__(pktt.tfile, state=False, cache_size=0)
+        for attr in ('ident', 'header', 'header_fmt', 'header_rec'):
+            setattr(self._pktt, attr, getattr(pktt, attr))
+        self._pktt.fh = StringIO('')
+
+    def __del__(self):
+        """Destructor
+
+           Close the trace file.
+        """
+        fh = getattr(self, '_fh', None)
+        if fh:
+            fh.close()
+
+    def __iter__(self):
+        """Make this object iterable."""
+        return self
+
+    def _select(self, key):
+        """Return True if the sampling unit given by key is selected"""
+        selected = self._selected.get(key)
+        if selected is None:
+            hval = zlib.crc32(str(key), self.seed) & 0xFFFFFFFF
+            selected = hval < self._threshold
+            self._selected[key] = selected
+        return selected
+
+    def _decode(self, rindex, header, data):
+        """Return the list of packets in the given record"""
+        pktt = self._pktt
+        rdata = header + data
+        pktt.fh = StringIO(rdata)
+        pktt.offset = 0
+        pktt.index = rindex
+        pkts = []
+        while pktt.offset < len(rdata):
+            # A record having more than one RPC packet gives a packet
+            # for each RPC packet
+            try:
+                pkts.append(pktt.next())
+            except StopIteration:
+                break
+        return pkts
+
+    def next(self):
+        """Get the next packet from the selected units or raise StopIteration.
+
+           The packet is also stored in the object attribute pkt.
+        """
+        fh = self._fh
+        while not self._pkts:
+            header = fh.read(16)
+            if len(header) < 16:
+                self.pkt = None
+                raise StopIteration
+            record = struct.unpack(self._header_rec, header)
+            length = record[2]
+            secs = record[0] + record[1]/1000000.0
+            if self._tstart is None:
+                self._tstart = secs
+                self._pktt.tstart = secs
+            rindex = self.rindex
+            self.rindex += 1
+            self.nrecords += 1
+
+            data = ''
+            if self.unit == 'time':
+                key = int((secs - self._tstart) / self.window)
+            else:
+                key = None
+                if self._link_type == 1:
+                    data = fh.read(min(length, _SAMPLE_keylen))
+                    key = _stream_key(data)
+                if key is None:
+                    # Each record not in a stream is a unit by itself
+                    key = rindex
+            if not self._select(key):
+                # Skip the rest of the record
+                fh.seek(length - len(data), 1)
+                continue
+
+            data += fh.read(length - len(data))
+            if len(data) < length:
+                self.pkt = None
+                raise StopIteration
+            self.nsampled += 1
+            self._pkts = self._decode(rindex, header, data)
+            for pkt in self._pkts:
+                pkt.unit = key
+
+        self.pkt = self._pkts.pop(0)
+        return self.pkt
+
+    def count(self, expr=None, zvalue=1.96):
+        """Return the tuple (total, error) for the estimated number of packets
+           matching the given expression in the whole trace file, starting
+           with the current packet, see estimate().
+
+           expr:
+               String of expressions to be evaluated, see Pktt.match()
+               [default: None, count all packets]
+           zvalue:
+               Number of standard deviations for the confidence interval
+               [default: 1.96, 95% confidence]
+
+           Examples:
+               # Estimated number of WRITE calls
+               total, error = PktSample(x, 0.05).count("NFS.argop == 38")
+               print "%d +/- %d" % (total, error)
+        """
+        pdata = None
+        if expr is not None:
+            pdata = self._pktt._convert_match(parser.st2list(parser.expr(expr)))
+        values = {}
+        for pkt in self:
+            if pdata is not None:
+                # Match functions are evaluated on the current packet
+                self._pktt.pkt = pkt
+                try:
+                    if not eval(pdata, {}, {'self': self._pktt}):
+                        continue
+                except Exception:
+                    continue
+            values[pkt.unit] = values.get(pkt.unit, 0) + 1
+        return estimate(values.values(), self.rate, zvalue)
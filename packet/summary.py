@@ -0,0 +1,318 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Chunk summary module
+
+Provides the summary of a chunk of consecutive packets in a trace file. The
+summary has the minimum and maximum timestamps, the sets of NFS operations
+and bloom filters of the RPC xids, file handles and stateids of all packets
+in the chunk. A chunk summary is used to tell if a chunk cannot have any
+packets matching a given match expression so the whole chunk can be skipped
+without decoding any of its packets.
+
+Match expression terms supported:
+    RPC.xid == <xid>
+    RPC.xid in [<xid>, ...]
+    NFS.argop|resop|op == <op>
+    NFS.argop|resop|op in [<op>, ...]
+    NFS.object == '<file handle>'
+    NFS.stateid.other == '<stateid>'
+"""
+import ast
+import nfstest_config as c
+from baseobj import BaseObj
+from packet.nfs.nfs4_const import nfs_opnum4
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Number of bits in each bloom filter
+_BLOOM_nbits = 1 << 18
+# Number of hash functions used by each bloom filter
+_BLOOM_nhashes = 4
+# Map of NFS operation to the attribute name of its arguments or results
+# in the compound array item, e.g., OP_PUTFH -> 'opputfh'
+_SUMMARY_opattr = dict((op, 'op' + name[3:].lower()) for op, name in nfs_opnum4.items())
+
+class BloomFilter(object):
+    """Bloom filter object
+
+       Usage:
+           from packet.summary import BloomFilter
+
+           x = BloomFilter()
+           x.add(value)
+
+           # Check if value could have been added to the filter,
+           # False means the value has definitely not been added
+           if value in x:
+               print "Found"
+    """
+    def __init__(self, nbits=_BLOOM_nbits, nhashes=_BLOOM_nhashes):
+        """Constructor
+
+           Initialize object's private data.
+
+           nbits:
+               Number of bits in the filter
+           nhashes:
+               Number of hash functions
+        """
+        self.nbits   = nbits
+        self.nhashes = nhashes
+        self.bits    = bytearray(nbits >> 3)
+
+    def _positions(self, value):
+        """Return the list of bit positions for the given value"""
+        hval = hash(value) & 0xFFFFFFFFFFFFFFFF
+        # Use double hashing to get all hash functions
+        hinc = (((hval * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) | 1
+        return [(hval + i*hinc) % self.nbits for i in xrange(self.nhashes)]
+
+    def add(self, value):
+        """Add value to the filter"""
+        bits = self.bits
+        for pos in self._positions(value):
+            bits[pos >> 3] |= (1 << (pos & 7))
+
+    def __contains__(self, value):
+        """Return False if value has not been added to the filter"""
+        bits = self.bits
+        for pos in self._positions(value):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class ChunkSummary(BaseObj):
+    """Chunk summary object
+
+       Usage:
+           from packet.summary import ChunkSummary
+
+           x = ChunkSummary(index)
+
+           # Add all packets in the chunk
+           x.add(pkt)
+
+       Object definition:
+
+       ChunkSummary(
+           index    = int,  # Packet index of the first packet in the chunk
+           count    = int,  # Number of packets in the chunk
+           mintime  = float,  # Minimum timestamp of all packets
+           maxtime  = float,  # Maximum timestamp of all packets
+           argops   = set,  # Set of NFS operations in all calls
+           resops   = set,  # Set of NFS operations in all replies
+           _xids     = BloomFilter(), # Bloom filter of RPC xids
+           _fhs      = BloomFilter(), # Bloom filter of file handles
+           _stateids = BloomFilter(), # Bloom filter of stateids
+       )
+    """
+    def __init__(self, index):
+        """Constructor
+
+           Initialize object's private data.
+
+           index:
+               Packet index of the first packet in the chunk
+        """
+        self.index     = index
+        self.count     = 0
+        self.mintime   = None
+        self.maxtime   = None
+        self.argops    = set()
+        self.resops    = set()
+        self._xids     = BloomFilter()
+        self._fhs      = BloomFilter()
+        self._stateids = BloomFilter()
+
+    def add(self, pkt):
+        """Add packet to the chunk summary"""
+        self.count += 1
+        secs = pkt.record.secs
+        if self.mintime is None or secs < self.mintime:
+            self.mintime = secs
+        if self.maxtime is None or secs > self.maxtime:
+            self.maxtime = secs
+
+        rpc = getattr(pkt, 'rpc', None)
+        if rpc is None:
+            return
+        self._xids.add(rpc.xid)
+
+        nfs = getattr(pkt, 'nfs', None)
+        if nfs is None:
+            return
+        array = getattr(nfs, 'argarray', None)
+        if array is None:
+            array = getattr(nfs, 'resarray', None)
+            if array is None:
+                return
+            opname = 'resop'
+            opset  = self.resops
+        else:
+            opname = 'argop'
+            opset  = self.argops
+
+        for item in array:
+            op = getattr(item, opname)
+            opset.add(op)
+            # Get the operation object directly instead of going through
+            # the item's __getattr__ for every attribute
+            obj = item.__dict__.get(_SUMMARY_opattr.get(op), item)
+            fh = getattr(obj, 'object', None)
+            if fh is not None:
+                self._fhs.add(fh)
+            stateid = getattr(obj, 'stateid', None)
+            if stateid is not None:
+                self._stateids.add(getattr(stateid, 'other', None))
+
+    def has_xid(self, xid):
+        """Return False if no packet in the chunk has the given RPC xid"""
+        return xid in self._xids
+
+    def has_fh(self, fh):
+        """Return False if no packet in the chunk has the given file handle"""
+        return fh in self._fhs
+
+    def has_stateid(self, stateid):
+        """Return False if no packet in the chunk has the given stateid"""
+        return stateid in self._stateids
+
+def match_literal(node):
+    """Return the constant value of the given expression node from a match
+       expression. Strings in a match expression are evaluated twice by
+       packet.pktt.Pktt.match(), e.g., when using Pktt.escape(), so they are
+       un-escaped twice as well. Raises ValueError if node is not a constant.
+    """
+    value = ast.literal_eval(node)
+    if isinstance(value, str):
+        value = value.decode('string_escape')
+    elif isinstance(value, (list, tuple, set)):
+        value = [v.decode('string_escape') if isinstance(v, str) else v for v in value]
+    return value
+
+def _summary_attr(node):
+    """Return the dotted name of the given attribute node"""
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        name = _summary_attr(node.value)
+        if name is not None:
+            return name + '.' + node.attr
+    return None
+
+def _summary_compare(node):
+    """Return the filter function for a single comparison or None if the
+       comparison cannot be checked using the chunk summary.
+    """
+    if len(node.ops) != 1:
+        return None
+    name = _summary_attr(node.left)
+    if name is None:
+        return None
+    try:
+        value = match_literal(node.comparators[0])
+    except Exception:
+        return None
+    opr = type(node.ops[0])
+    if opr is ast.Eq:
+        values = [value]
+    elif opr is ast.In and isinstance(value, (list, tuple, set)):
+        values = list(value)
+    else:
+        return None
+
+    if name == 'RPC.xid':
+        return lambda s: any(s.has_xid(v) for v in values)
+    elif name == 'NFS.object':
+        return lambda s: any(s.has_fh(v) for v in values)
+    elif name == 'NFS.stateid.other':
+        return lambda s: any(s.has_stateid(v) for v in values)
+    elif name == 'NFS.argop':
+        return lambda s: any(v in s.argops for v in values)
+    elif name == 'NFS.resop':
+        return lambda s: any(v in s.resops for v in values)
+    elif name == 'NFS.op':
+        return lambda s: any(v in s.argops or v in s.resops for v in values)
+    return None
+
+def _summary_node(node):
+    """Return the filter function for the given expression node or None if
+       the expression cannot be checked using the chunk summary.
+    """
+    if isinstance(node, ast.Compare):
+        return _summary_compare(node)
+    elif isinstance(node, ast.BoolOp):
+        funcs = [_summary_node(item) for item in node.values]
+        if isinstance(node.op, ast.And):
+            # Terms which cannot be checked are ignored
+            funcs = [func for func in funcs if func is not None]
+            if len(funcs) == 0:
+                return None
+            return lambda s: all(func(s) for func in funcs)
+        elif [func for func in funcs if func is None]:
+            return None
+        return lambda s: any(func(s) for func in funcs)
+    return None
+
+def summary_filter(expr):
+    """Return a function which takes a chunk summary as its only argument
+       and returns False if the chunk cannot have any packet matching the
+       given match expression. Returns None if the expression cannot be
+       checked using the chunk summary.
+
+       expr:
+           Match expression, see packet.pktt.Pktt.match()
+
+       Examples:
+           sfilter = summary_filter("RPC.xid == 0x1234abcd")
+           if sfilter and not sfilter(summary):
+               # Skip chunk
+    """
+    try:
+        node = ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    return _summary_node(node)
+
+if __name__ == '__main__':
+    # Self test of module
+    bfilter = BloomFilter()
+    values = range(0x1000, 0x3000) + ["fh%06d" % i for i in xrange(2000)]
+    for value in values:
+        bfilter.add(value)
+    ntests = 3
+    tcount = 0
+    if all(value in bfilter for value in values):
+        tcount += 1
+    fpos = sum(1 for i in xrange(10000) if ("xx%06d" % i) in bfilter)
+    if fpos < 100:
+        tcount += 1
+    sfilter = summary_filter("NFS.argop == 38 and RPC.xid in [1, 0x1234] and IP.src == '1.1.1.1'")
+    summary = ChunkSummary(0)
+    summary.argops.add(38)
+    summary._xids.add(0x1234)
+    if sfilter(summary) and summary_filter("IP.src == '1.1.1.1' or RPC.xid == 1") is None:
+        tcount += 1
+
+    if tcount == ntests:
+        print "All tests passed!"
+        exit(0)
+    else:
+        print "%d tests failed" % (ntests-tcount)
+        exit(1)
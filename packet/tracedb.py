@@ -0,0 +1,294 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Trace database module
+
+Provides a persistent store for the NFS operations found in a packet trace
+file. The store is an SQLite database having a row for each NFS operation
+of every call/reply pair found in the trace file. Each row includes the
+packet index and file offset of both the call and the reply so only the
+packets returned by a lookup need to be decoded. The database is created
+once and it can be re-used any number of times as long as the trace file
+is not modified.
+
+Database row:
+    nfsop(
+        call_index   = Packet index of the call
+        call_offset  = File offset of the call record
+        reply_index  = Packet index of the reply, NULL if no reply
+        reply_offset = File offset of the reply record, NULL if no reply
+        xid          = RPC transaction id
+        op           = NFS operation
+        opidx        = Index of the operation in the compound
+        src          = Source IP address of the call
+        dst          = Destination IP address of the call
+        sport        = TCP source port of the call
+        dport        = TCP destination port of the call
+        status       = Status of the operation in the reply, NULL if no reply
+        fh           = Current file handle of the operation
+        stateid      = Stateid 'other' field of the operation
+        time         = Timestamp of the call
+    )
+"""
+import os
+import sqlite3
+import nfstest_config as c
+from baseobj import BaseObj
+from packet.nfs.nfs4_const import *
+from packet.internet.ipv6addr import IPv6Addr
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Version of the database schema and contents, a database having a different
+# version is created again
+_TRACEDB_version = 2
+
+# Database schema
+_TRACEDB_schema = [
+    "CREATE TABLE trace (tfile TEXT, size INTEGER, mtime REAL, version INTEGER)",
+    "CREATE TABLE nfsop (call_index INTEGER, call_offset INTEGER, " + \
+        "reply_index INTEGER, reply_offset INTEGER, xid INTEGER, op INTEGER, " + \
+        "opidx INTEGER, src TEXT, dst TEXT, sport INTEGER, dport INTEGER, " + \
+        "status INTEGER, fh BLOB, stateid BLOB, time REAL)",
+    "CREATE INDEX nfsop_call ON nfsop (call_index)",
+    "CREATE INDEX nfsop_xid ON nfsop (xid)",
+    "CREATE INDEX nfsop_op ON nfsop (op)",
+    "CREATE INDEX nfsop_fh ON nfsop (fh)",
+    "CREATE INDEX nfsop_stateid ON nfsop (stateid)",
+    "CREATE INDEX nfsop_time ON nfsop (time)",
+]
+
+# Operations which change the current file handle
+_TRACEDB_fhops = set([OP_PUTROOTFH, OP_PUTPUBFH, OP_LOOKUP, OP_LOOKUPP, OP_OPEN, OP_CREATE])
+
+# Map of lookup arguments to their column and comparison
+_TRACEDB_find_map = {
+    'xid':     "xid = ?",
+    'op':      "op = ?",
+    'src':     "src = ?",
+    'dst':     "dst = ?",
+    'sport':   "sport = ?",
+    'dport':   "dport = ?",
+    'status':  "status = ?",
+    'fh':      "fh = ?",
+    'stateid': "stateid = ?",
+    'start':   "call_index >= ?",
+    'end':     "call_index < ?",
+    'mintime': "time >= ?",
+    'maxtime': "time <= ?",
+}
+
+def _blob(data):
+    """Return the database representation of binary data"""
+    if data is None:
+        return None
+    return sqlite3.Binary(data)
+
+def _ipaddr(value):
+    """Return the database representation of an IP address, an IPv6
+       address is saved in its compressed form as given by IPv6Addr so the
+       address is converted the same way, any other address is returned
+       as given.
+    """
+    try:
+        return IPv6Addr._convert(value)
+    except Exception:
+        return value
+
+class TraceDB(BaseObj):
+    """Trace database object
+
+       Usage:
+           from packet.tracedb import TraceDB
+
+           x = TraceDB("/traces/tracefile.cap.db")
+
+           # Create the database if it is not valid for the trace file
+           if not x.isvalid("/traces/tracefile.cap"):
+               x.export(pktt)
+
+           # Find all WRITE calls going to the given server
+           for row in x.find(op=OP_WRITE, dst='192.168.0.62'):
+               print row['call_index'], row['reply_index']
+    """
+    def __init__(self, dbfile):
+        """Constructor
+
+           Initialize object's private data and open the database.
+
+           dbfile:
+               Name of the database file
+        """
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.row_factory = sqlite3.Row
+
+    def __del__(self):
+        """Destructor
+
+           Gracefully close the database.
+        """
+        conn = getattr(self, 'conn', None)
+        if conn:
+            conn.close()
+
+    @staticmethod
+    def _trace_info(tfile):
+        """Return the tuple identifying the contents of the trace file"""
+        fstat = os.stat(tfile)
+        return (os.path.realpath(tfile), fstat.st_size, fstat.st_mtime)
+
+    def isvalid(self, tfile):
+        """Return True if the database has been created for the given trace
+           file and the trace file has not been modified since.
+        """
+        try:
+            row = self.conn.execute("SELECT * FROM trace").fetchone()
+        except sqlite3.Error:
+            return False
+        if row is None or row['version'] != _TRACEDB_version:
+            return False
+        return (row['tfile'], row['size'], row['mtime']) == self._trace_info(tfile)
+
+    def export(self, pktt):
+        """Write all NFS operations found in the packet trace to the database,
+           any previous contents of the database are removed. All packets are
+           processed starting at the current position of the packet trace.
+           The offset of each packet is the offset of its record, so the
+           packet trace object does not need to keep its state.
+
+           pktt:
+               Packet trace object (packet.pktt.Pktt)
+        """
+        conn = self.conn
+        for table in ('trace', 'nfsop'):
+            conn.execute("DROP TABLE IF EXISTS %s" % table)
+        for sql in _TRACEDB_schema:
+            conn.execute(sql)
+
+        # Rows for all calls waiting for their reply keyed by the connection
+        # and the xid (see Pktt.pairs()), a reply is paired with all calls
+        # having the same key so retransmitted calls also get the reply
+        pending = {}
+        sql = "INSERT INTO nfsop VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+        for pkt in pktt:
+            nfs = getattr(pkt, 'nfs', None)
+            if nfs is None:
+                continue
+            index = pkt.record.index
+            argarray = getattr(nfs, 'argarray', None)
+            if argarray is not None:
+                ip  = pkt.ip
+                tcp = getattr(pkt, 'tcp', None)
+                sport = tcp.src_port if tcp else None
+                dport = tcp.dst_port if tcp else None
+                rows = []
+                fh = None
+                for opidx, item in enumerate(argarray):
+                    op = item.argop
+                    if op == OP_PUTFH:
+                        fh = item.object
+                    elif op in _TRACEDB_fhops:
+                        # Current file handle is not known
+                        fh = None
+                    stateid = getattr(item, 'stateid', None)
+                    if stateid is not None:
+                        stateid = stateid.other
+                    rows.append([index, pktt.b_offset, None, None,
+                                 pkt.rpc.xid, op, opidx, ip.src, ip.dst,
+                                 sport, dport, None, _blob(fh),
+                                 _blob(stateid), pkt.record.secs])
+                key = pktt._pair_key(pkt, pkt.rpc.xid)
+                pending.setdefault(key, []).append(rows)
+                continue
+
+            resarray = getattr(nfs, 'resarray', None)
+            if resarray is None:
+                continue
+            key = pktt._pair_key(pkt, pkt.rpc.xid, reply=True)
+            if key not in pending:
+                continue
+            for rows in pending.pop(key):
+                for opidx, row in enumerate(rows):
+                    row[2] = index
+                    row[3] = pktt.b_offset
+                    if opidx < len(resarray):
+                        row[11] = getattr(resarray[opidx], 'status', None)
+                conn.executemany(sql, rows)
+
+        # Save all calls without a reply
+        for key in pending:
+            for rows in pending[key]:
+                conn.executemany(sql, rows)
+
+        conn.execute("INSERT INTO trace VALUES (?,?,?,?)", self._trace_info(pktt.tfile) + (_TRACEDB_version,))
+        conn.commit()
+
+    def find(self, **kwargs):
+        """Return the list of distinct call/reply pairs ordered by the packet
+           index of the call having an NFS operation matching all the given
+           arguments. Each item in the list has the following keys: call_index,
+           call_offset, reply_index, reply_offset and xid.
+
+           xid:
+               RPC transaction id
+           op:
+               NFS operation
+           src:
+               Source IP address of the call
+           dst:
+               Destination IP address of the call
+           sport:
+               TCP source port of the call
+           dport:
+               TCP destination port of the call
+           status:
+               Status of the operation in the reply
+           fh:
+               Current file handle of the operation
+           stateid:
+               Stateid 'other' field of the operation
+           start:
+               Find calls starting at this packet index
+           end:
+               Find calls before this packet index
+           mintime:
+               Find calls at or after this timestamp
+           maxtime:
+               Find calls at or before this timestamp
+        """
+        where = []
+        values = []
+        for name in sorted(kwargs):
+            value = kwargs[name]
+            if value is None:
+                continue
+            sql = _TRACEDB_find_map.get(name)
+            if sql is None:
+                raise Exception("Unknown trace database argument: %s" % name)
+            if name in ('fh', 'stateid'):
+                value = _blob(value)
+            elif name in ('src', 'dst'):
+                value = _ipaddr(value)
+            where.append(sql)
+            values.append(value)
+        sql = "SELECT DISTINCT call_index, call_offset, reply_index, reply_offset, xid FROM nfsop"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY call_index"
+        return self.conn.execute(sql, values).fetchall()
@@ -0,0 +1,267 @@
+#===============================================================================
+# Copyright 2012 NetApp, Inc. All Rights Reserved,
+# contribution by Jorge Mora <mora@netapp.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#===============================================================================
+"""
+Trace set module
+
+Provides a single random access packet trace for all the trace files created
+by tcpdump when using the '-C' option: the base trace file followed by the
+trace files having the same name with a numeric suffix, e.g., 'tracefile.cap',
+'tracefile.cap1', 'tracefile.cap2', etc.
+
+Each trace file is decoded by its own packet trace object, so each one has
+its own packet map and checkpoints. A global packet index is mapped to the
+trace file having the packet and the packet index within that trace file,
+so moving to any packet only processes packets in that trace file starting
+from the nearest checkpoint. All trace files can be indexed in parallel
+using multiple processes, see TraceSet.index_files().
+
+As with a live trace (see packet.pktt.Pktt), the state of all TCP streams
+and RPC calls is not carried over from one trace file to the next, and the
+record index and timestamp of each packet are relative to its own trace
+file. Each packet returned has the following attribute to identify its
+source:
+    tfile = Name of the trace file where the packet came from
+"""
+import os
+import multiprocessing
+import nfstest_config as c
+from baseobj import BaseObj
+from packet.pktt import Pktt
+
+# Module constants
+__author__    = 'Jorge Mora (%s)' % c.NFSTEST_AUTHOR_EMAIL
+__version__   = '1.0.1'
+__copyright__ = "Copyright (C) 2012 NetApp, Inc."
+__license__   = "GPL v2"
+
+# Attributes of a fully processed packet trace object returned by a
+# worker process to the trace set
+_TRACESET_attrs = ['pkt_map', 'pkt_times', '_checkpoints', '_summaries', '_rpc_xid_map', 'tstart',
+                   'counters']
+
+def _index_trace(tfile):
+    """Process the whole trace file and return the number of packets and
+       the attributes needed to move to any packet in the trace file.
+       This is the function run by each worker process.
+    """
+    pktt = Pktt(tfile, cache_size=0)
+    for pkt in pktt:
+        pass
+    return (pktt.index, dict((attr, getattr(pktt, attr)) for attr in _TRACESET_attrs))
+
+class TraceSet(BaseObj):
+    """Trace set object
+
+       Usage:
+           from packet.traceset import TraceSet
+
+           x = TraceSet("/traces/tracefile.cap")
+
+           # Index all trace files using multiple processes
+           x.index_files()
+
+           # Get packet given by its global index
+           pkt = x[125000]
+
+           # Iterate over all packets found in all trace files
+           for pkt in x:
+               print pkt.tfile, pkt
+    """
+    def __init__(self, tfile, **kwargs):
+        """Constructor
+
+           Initialize object's private data, get the list of all trace files
+           in the set. None of the trace files are opened until a packet is
+           retrieved. Getting a packet by its global index, rewinding or
+           getting the number of packets needs the number of packets in
+           the trace files before it, so all trace files which have not
+           been processed yet are indexed in parallel, see index_files().
+
+           tfile:
+               Name of the base trace file
+
+           All extra options are passed directly to each packet trace object.
+        """
+        self.tfile  = tfile
+        self.tfiles = [tfile]
+        while os.path.isfile("%s%d" % (tfile, len(self.tfiles))):
+            self.tfiles.append("%s%d" % (tfile, len(self.tfiles)))
+        self.pktts  = [Pktt(name, **kwargs) for name in self.tfiles]
+        self.counts = [None] * len(self.tfiles)  # Number of packets in each trace file
+        self.sindex = 0     # Index of the current trace file
+        self.index  = 0     # Current global packet index
+        self.pkt    = None  # Current packet
+
+    def __iter__(self):
+        """Make this object iterable."""
+        return self
+
+    def __len__(self):
+        """Return the number of packets in all trace files, all trace files
+           are indexed if this is not known.
+        """
+        return self._base(len(self.pktts))
+
+    def _count(self, sindex):
+        """Return the number of packets in the given trace file, all trace
+           files which have not been processed yet are indexed in parallel
+           if this is not known.
+        """
+        if self.counts[sindex] is None:
+            self.index_files()
+        return self.counts[sindex]
+
+    def _base(self, sindex):
+        """Return the global packet index of the first packet in the given
+           trace file.
+        """
+        return sum(self._count(i) for i in xrange(sindex))
+
+    def _locate(self, index):
+        """Return the tuple (sindex, local index) for the given global packet
+           index or raise IndexError.
+        """
+        base = 0
+        for sindex in xrange(len(self.pktts)):
+            count = self._count(sindex)
+            if index < base + count:
+                return (sindex, index - base)
+            base += count
+        raise IndexError
+
+    def index_files(self, procs=None):
+        """Process all trace files which have not been processed yet using
+           a pool of worker processes, afterwards any packet in the trace set
+           can be retrieved without processing any other trace file.
+
+           procs:
+               Number of worker processes [default: number of CPUs]
+        """
+        tlist = [i for i in xrange(len(self.pktts)) if self.counts[i] is None]
+        if not tlist:
+            return
+        self.dprintf('PKT1', ">>> TraceSet.index_files(%d trace files)", len(tlist))
+        if len(tlist) == 1 or procs == 1:
+            results = [_index_trace(self.tfiles[i]) for i in tlist]
+        else:
+            pool = multiprocessing.Pool(procs)
+            try:
+                results = pool.map(_index_trace, [self.tfiles[i] for i in tlist])
+            finally:
+                pool.close()
+                pool.join()
+
+        for sindex, (count, attrs) in zip(tlist, results):
+            pktt = self.pktts[sindex]
+            save_index = pktt.index
+            pktt._getfh()
+            for attr in _TRACESET_attrs:
+                setattr(pktt, attr, attrs[attr])
+            pktt.mindex = len(pktt.pkt_map) - 1
+            # Share the processed trace file with other packet trace objects
+            pktt._register()
+            self.counts[sindex] = count
+            pktt.rewind(min(save_index, count))
+
+    def next(self):
+        """Get the next packet from the trace set or raise StopIteration.
+
+           The packet is also stored in the object attribute pkt.
+        """
+        while True:
+            pktt = self.pktts[self.sindex]
+            try:
+                self.pkt = pktt.next()
+                self.pkt.tfile = pktt.tfile
+                self.index += 1
+                return self.pkt
+            except StopIteration:
+                self.counts[self.sindex] = pktt.index
+                if self.sindex + 1 >= len(self.pktts):
+                    self.pkt = None
+                    raise
+                # Continue with the first packet of the next trace file
+                self.sindex += 1
+                self.pktts[self.sindex].rewind(0)
+
+    def __getitem__(self, index):
+        """Get the packet given by the global packet index or raise IndexError.
+
+           The packet is also stored in the object attribute pkt.
+        """
+        if index < 0:
+            # No negative index is allowed
+            raise IndexError
+        sindex, lindex = self._locate(index)
+        pktt = self.pktts[sindex]
+        self.pkt = pktt[lindex]
+        self.pkt.tfile = pktt.tfile
+        self.sindex = sindex
+        self.index = index + 1
+        return self.pkt
+
+    def rewind(self, index=0):
+        """Rewind the trace set by setting the file pointer to the start of
+           the given global packet index. Returns False if unable to rewind,
+           e.g., when the given index is beyond the last packet.
+        """
+        self.dprintf('PKT1', ">>> TraceSet.rewind(%d)", index)
+        try:
+            sindex, lindex = self._locate(index)
+        except IndexError:
+            return False
+        if not self.pktts[sindex].rewind(lindex):
+            return False
+        self.sindex = sindex
+        self.index = index
+        return True
+
+    def match(self, expr, maxindex=None):
+        """Return the packet that matches the given expression, also the
+           packet index points to the next packet after the matched packet.
+           Returns None if packet is not found and the packet index points
+           to the packet at the beginning of the search.
+
+           expr:
+               String of expressions to be evaluated, see Pktt.match()
+           maxindex:
+               The match fails if the global packet index hits this limit
+        """
+        save_index = self.index
+        while True:
+            pktt = self.pktts[self.sindex]
+            base = self.index - pktt.index
+            lmax = None
+            if maxindex:
+                lmax = maxindex - base
+                if lmax <= pktt.index:
+                    break
+            pkt = pktt.match(expr, maxindex=lmax)
+            if pkt is not None:
+                pkt.tfile = pktt.tfile
+                self.pkt = pkt
+                self.index = base + pktt.index
+                return pkt
+            if self.sindex + 1 >= len(self.pktts):
+                break
+            # Continue searching on the next trace file
+            self.index = base + self._count(self.sindex)
+            self.sindex += 1
+            self.pktts[self.sindex].rewind(0)
+
+        # No packet matched, re-position the file pointer back to where
+        # the search started
+        self.rewind(save_index)
+        self.pkt = None
+        return None
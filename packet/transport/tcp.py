@@ -16,6 +16,7 @@ TCP module
 
 Decode TCP layer.
 """
+import copy
 import nfstest_config as c
 from baseobj import BaseObj
 from packet.application.rpc import RPC
@@ -87,77 +88,103 @@ class TCP(BaseObj, Unpack):
            data:
                Raw packet data for this layer.
         """
-        self.data = data
-        # Decode the TCP layer header
-        ulist = self.unpack(20, 'HHIIBBHHH')
-        temp = ulist[4] >> 4
-        count = 4*temp
-        self.src_port    = ulist[0]
-        self.dst_port    = ulist[1]
-        self.seq_number  = ulist[2]
-        self.ack_number  = ulist[3]
-        self.hl          = temp
-        self.header_size = count
-        self.window_size = ulist[6]
-        self.checksum    = ulist[7]
-        self.urgent_ptr  = ulist[8]
-        self.flags_raw   = (ulist[5] & 0xFF)
-        self.flags = Flags(
-            FIN = (ulist[5] & 0x01),
-            SYN = ((ulist[5] >> 1) & 0x01),
-            RST = ((ulist[5] >> 2) & 0x01),
-            PSH = ((ulist[5] >> 3) & 0x01),
-            ACK = ((ulist[5] >> 4) & 0x01),
-            URG = ((ulist[5] >> 5) & 0x01),
-            ECE = ((ulist[5] >> 6) & 0x01),
-            CWR = ((ulist[5] >> 7) & 0x01),
-        )
-        pktt.pkt.tcp = self
-
-        # Stream identifier
-        streamid = self._streamid(pktt.pkt)
-
-        if not getattr(pktt, '_tcp_stream_map', None):
-            # TCP stream map: to keep track of the different TCP streams
-            # within the trace file -- used to deal with RPC packets spanning
-            # multiple TCP packets or to handle a TCP packet having multiple
-            # RPC packets
-            pktt._tcp_stream_map = {}
-
-        if streamid not in pktt._tcp_stream_map:
-            # msfrag: Keep track of RPC packets spanning multiple TCP packets
-            # frag_off: Keep track of multiple RPC packets within
-            #           a single TCP packet
-            pktt._tcp_stream_map[streamid] = {
-                'seq_base': self.seq_number,
-                'smap':     {},
-                'pindex':   pktt.index,
-                'msfrag':   '',
-                'frag_off': 0,
-                'last_seq': 0,
-            }
-
-        # De-reference stream map
-        stream = pktt._tcp_stream_map[streamid]
-
-        if self.flags.SYN:
-            # Reset seq_base on SYN
-            stream['seq_base'] = self.seq_number
-            stream['last_seq'] = 0
-
-        # Convert sequence numbers to relative numbers
-        seq = self.seq_number - stream['seq_base']
-        self.seq = seq
-
-        if count > 20:
-            osize = count - 20
-            self.options = self.rawdata(osize)
-
-        # Save length of TCP segment
-        self.length = len(self.data)
-
-        if seq < stream['last_seq']:
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            self.data = data
+            if pktt._isnew:
+                pktt.counters['tcp_bytes'] += len(data)
+            # Decode the TCP layer header
+            ulist = self.unpack(20, 'HHIIBBHHH')
+            temp = ulist[4] >> 4
+            count = 4*temp
+            self.src_port    = ulist[0]
+            self.dst_port    = ulist[1]
+            self.seq_number  = ulist[2]
+            self.ack_number  = ulist[3]
+            self.hl          = temp
+            self.header_size = count
+            self.window_size = ulist[6]
+            self.checksum    = ulist[7]
+            self.urgent_ptr  = ulist[8]
+            self.flags_raw   = (ulist[5] & 0xFF)
+            self.flags = Flags(
+                FIN = (ulist[5] & 0x01),
+                SYN = ((ulist[5] >> 1) & 0x01),
+                RST = ((ulist[5] >> 2) & 0x01),
+                PSH = ((ulist[5] >> 3) & 0x01),
+                ACK = ((ulist[5] >> 4) & 0x01),
+                URG = ((ulist[5] >> 5) & 0x01),
+                ECE = ((ulist[5] >> 6) & 0x01),
+                CWR = ((ulist[5] >> 7) & 0x01),
+            )
+            pktt.pkt.tcp = self
+
+            # Stream identifier
+            streamid = self._streamid(pktt.pkt)
+
+            if not getattr(pktt, '_tcp_stream_map', None):
+                # TCP stream map: to keep track of the different TCP streams
+                # within the trace file -- used to deal with RPC packets spanning
+                # multiple TCP packets or to handle a TCP packet having multiple
+                # RPC packets
+                pktt._tcp_stream_map = {}
+
+            if count > 20:
+                osize = count - 20
+                self.options = self.rawdata(osize)
+
+            # Save length of TCP segment
+            self.length = len(self.data)
+
+            stream = pktt._tcp_stream_map.get(streamid)
+            if stream is None:
+                if self.length == 0 and not self.flags.SYN:
+                    # Nothing to decode on a stream not seen yet, e.g., the
+                    # last ACK of a closed connection, do not add the stream
+                    self.seq = 0
+                    return
+                # msfrag: Keep track of RPC packets spanning multiple TCP packets
+                # frag_off: Keep track of multiple RPC packets within
+                #           a single TCP packet
+                stream = {
+                    'seq_base': self.seq_number,
+                    'smap':     {},
+                    'pindex':   pktt.index,
+                    'msfrag':   '',
+                    'frag_off': 0,
+                    'last_seq': 0,
+                }
+                pktt._tcp_stream_map[streamid] = stream
+
+            if self.flags.SYN:
+                # Reset seq_base on SYN
+                stream['seq_base'] = self.seq_number
+                stream['last_seq'] = 0
+
+            # Convert sequence numbers to relative numbers
+            seq = self.seq_number - stream['seq_base']
+            self.seq = seq
+
+            self._process(pktt, stream)
+            self._closed(pktt, streamid)
+        finally:
+            if timing is not None:
+                timing.stop('TCP', token)
+        return
+
+    def _process(self, pktt, stream, cont=False):
+        """Process TCP segment on its stream and decode its payload.
+
+           cont:
+               The payload data is the rest of the segment after an RPC
+               packet already decoded from this same segment
+        """
+        if self.seq < stream['last_seq']:
             # This is a re-transmission, do not process
+            if pktt._isnew:
+                pktt.counters['retransmissions'] += 1
             return
 
         # Save data
@@ -171,23 +198,61 @@ class TCP(BaseObj, Unpack):
            len(self.data) <= 20 and self.data == '\x00' * len(self.data):
             save_data = ""
 
-        # Append segment to the stream map
-        if pktt.index == pktt.mindex:
-            smap = stream['smap']
-            if len(stream['msfrag']) == 0 and stream['frag_off'] == 0:
-                stream['pindex'] = pktt.index
-            else:
-                smap_item = [stream['pindex'], stream['frag_off']]
-                smap[pktt.index] = smap_item
+        if len(stream['msfrag']) == 0 and stream['frag_off'] == 0:
+            # An RPC packet starts on this segment
+            stream['pindex'] = pktt.index
+        elif pktt.index == pktt.mindex:
+            # Append segment to the stream map
+            smap_item = [stream['pindex'], stream['frag_off']]
+            stream['smap'][pktt.index] = smap_item
 
-        self._decode_payload(pktt, stream)
+        self._decode_payload(pktt, stream, cont)
 
         if getattr(pktt.pkt, 'rpc', None) or len(save_data) == 0:
             stream['pindex'] = pktt.index
 
         if self.length > 0:
-            stream['last_seq'] = seq
-        return
+            stream['last_seq'] = self.seq
+
+    def _continue(self, pktt, data):
+        """Decode the next RPC packet within this TCP segment as a new
+           packet. The TCP layer is copied from this object and the lower
+           layers are shared with the previous packet, so the segment is
+           not read or decoded again.
+
+           pktt:
+               Packet trace object (packet.pktt.Pktt), its current packet
+               is the new packet having the lower layers already set
+           data:
+               Rest of the segment data starting at the next RPC packet
+        """
+        timing = pktt.timing
+        if timing is not None:
+            token = timing.start()
+        try:
+            tcp = copy.copy(self)
+            tcp.data = data
+            pktt.pkt.tcp = tcp
+            streamid = tcp._streamid(pktt.pkt)
+            tcp._process(pktt, pktt._tcp_stream_map[streamid], cont=True)
+            tcp._closed(pktt, streamid)
+        finally:
+            if timing is not None:
+                timing.stop('TCP', token)
+
+    def _closed(self, pktt, streamid):
+        """Remove the stream from the TCP stream map once the connection
+           is closed (FIN or RST) and all the RPC packets within this segment
+           have been decoded, so the map only has the open connections.
+           A segment without payload does not add a stream to the map, so
+           the last ACK of the connection does not add it back.
+        """
+        if (self.flags.FIN or self.flags.RST) and pktt._tcp_cont is None:
+            pktt._tcp_stream_map.pop(streamid, None)
+            if self.flags.RST:
+                # The connection is aborted in both directions
+                src, sport, dst, dport = streamid
+                pktt._tcp_stream_map.pop((dst, dport, src, sport), None)
 
     def __str__(self):
         """String representation of object
@@ -217,10 +282,10 @@ class TCP(BaseObj, Unpack):
             out = BaseObj.__str__(self)
         return out
 
-    def _decode_payload(self, pktt, stream):
+    def _decode_payload(self, pktt, stream, cont=False):
         """Decode TCP payload."""
         rpc = None
-        if stream['frag_off'] > 0 and len(stream['msfrag']) == 0:
+        if not cont and stream['frag_off'] > 0 and len(stream['msfrag']) == 0:
             # This RPC packet lies within previous TCP packet,
             # Re-position the offset of the data
             self.data = self.data[stream['frag_off']:]
@@ -240,6 +305,8 @@ class TCP(BaseObj, Unpack):
             # There has been some data lost in the capture,
             # to continue decoding next packets, reset stream
             # except if this packet is just a TCP ACK (flags = 0x10)
+            if pktt._isnew and len(stream['msfrag']) > 0:
+                pktt.counters['resyncs'] += 1
             stream['msfrag'] = ''
             stream['frag_off'] = 0
 
@@ -251,6 +318,9 @@ class TCP(BaseObj, Unpack):
            size <= 20 and save_data == '\x00' * size:
             return
 
+        # Index of the packet where the RPC packet starts
+        pindex = stream['pindex'] if len(stream['msfrag']) > 0 else pktt.index
+
         if not rpc:
             # Concatenate previous fragment
             self.data = stream['msfrag'] + self.data
@@ -274,7 +344,10 @@ class TCP(BaseObj, Unpack):
                 stream['frag_off'] = 0
             stream['msfrag'] = ''
             # Save RPC layer on packet object
+            rpc._pindex = pindex
             pktt.pkt.rpc = rpc
+            if pktt._isnew:
+                pktt.counters['rpc_bytes'] += rpcsize + 4
             del self.data
 
             # Decode NFS layer
@@ -299,17 +372,19 @@ class TCP(BaseObj, Unpack):
                     # Save the multi-span fragment data
                     stream['msfrag'] += save_data
                 else:
-                    # Next RPC packet is entirely within this TCP packet
-                    # Re-position the file pointer to the current offset
+                    # Next RPC packet is entirely within this TCP packet,
+                    # it is decoded as the next packet from the rest of the
+                    # data and the file offset is kept at the current record
                     pktt.offset = pktt.b_offset
-                    pktt._getfh().seek(pktt.offset)
+                    pktt._tcp_cont = (pktt.pkt, rpc.data)
             else:
                 stream['frag_off'] = 0
 
     def _streamid(self, pkt):
-        """Get TCP streamid."""
-        streamid = "%s:%d-%s:%d" % (pkt.ip.src,
-                                    pkt.tcp.src_port,
-                                    pkt.ip.dst,
-                                    pkt.tcp.dst_port)
-        return streamid
+        """Get TCP streamid.
+
+           The stream is identified by the raw source and destination
+           addresses and ports, the string representation of the
+           addresses is not used since it is more expensive to hash.
+        """
+        return (pkt.ip._saddr, self.src_port, pkt.ip._daddr, self.dst_port)